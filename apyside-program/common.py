@@ -3,7 +3,12 @@ from datetime import date, datetime, timedelta
 import calendar
 from openpyxl.styles import PatternFill, Font
 from itertools import cycle
+from collections import Counter, defaultdict
+import heapq
 import random
+import csv
+import json
+import os
 
 # Simplified weekday names in Chinese
 WEEKDAYS = ["一", "二", "三", "四", "五", "六", "日"]
@@ -16,6 +21,25 @@ GREEN_FILL = PatternFill(start_color="90EE90", end_color="90EE90", fill_type="so
 BLUE_FILL = PatternFill(start_color="7db5e3", end_color="7db5e3", fill_type="solid")    # Blue for weekdays
 YELLOW_FILL = PatternFill(start_color="FFFFE0", end_color="FFFFE0", fill_type="solid") # Light yellow for weekends
 
+# Kinds of absence that can be entered; the kind is written into the cell
+LEAVE_TYPES = ["年假", "病假", "培训"]
+
+# Every value a schedule cell can hold
+SHIFT_TYPES = ["工作", "休息", "值班", "江东班", "开发班", "内勤", "外勤"] + LEAVE_TYPES
+
+# Cells that do not count as someone on duty
+OFF_SHIFTS = {"休息"} | set(LEAVE_TYPES)
+
+# Rest days every non-director gets per week
+REST_PER_WEEK = 2
+
+# Fewest days between two 值班 for the same person; 值班 on a Saturday and the Sunday right after it
+# is one weekend duty (the 江东 weekend rotation), not two duties a day apart
+DUTY_MIN_GAP = 4
+
+# Most 开发班 one person may hold in a month
+DEV_DUTY_LIMIT = 4
+
 # Statutory holidays for 2025 (example, expand with real dates)
 STATUTORY_HOLIDAYS = [
     date(2025, 1, 1),  # New Year's Day
@@ -24,6 +48,141 @@ STATUTORY_HOLIDAYS = [
     # Add more holidays as needed
 ]
 
+# Cumulative duty counts per pool and employee, recorded month by month so fairness carries over
+# from one month to the next. A month's record is taken from the finished schedule, and replaced
+# when the month is regenerated or its cells change (e.g. a swap), so it never double-counts
+# With a directory, each month is kept in its own YYYY-MM.json, written only when that month changes
+class FairnessLedger:
+    def __init__(self, directory=None):
+        self.directory = directory
+        # "YYYY-MM" -> {"loads": {key: {employee: [count, last ISO date]}}, "credits": {pool: [7 floats]}}
+        self.months = {}
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".json"):
+                    with open(os.path.join(directory, name), encoding="utf-8") as f:
+                        self.months[name[:-len(".json")]] = json.load(f)
+        self.current = None
+
+    # In-memory copy that is never written back, e.g. for months built outside the live store
+    def snapshot(self):
+        ledger = FairnessLedger()
+        ledger.months = {key: dict(record) for key, record in self.months.items()}
+        return ledger
+
+    def begin_month(self, year, month):
+        self.year, self.month = year, month
+        self.current = f"{year}-{month:02d}"
+        self.base = defaultdict(dict)
+        self.month_loads = defaultdict(dict)
+        self.month_credits = {}
+        earlier = sorted(key for key in self.months if key < self.current)
+        for key in earlier:
+            for ledger_key, loads in self.months[key]["loads"].items():
+                base = self.base[ledger_key]
+                for employee, (count, last) in loads.items():
+                    prev_count, prev_last = base.get(employee, (0, 0))
+                    base[employee] = (prev_count + count, max(prev_last, date.fromisoformat(last).toordinal()))
+        # Fractional demand left over at the end of the previous month
+        self.start_credits = self.months[earlier[-1]]["credits"] if earlier else {}
+
+    # (count, ordinal of the last assignment) up to now, including this month
+    def load(self, ledger_key, employee):
+        count, last = self.base[ledger_key].get(employee, (0, 0))
+        month_count, month_last = self.month_loads[ledger_key].get(employee, (0, 0))
+        return count + month_count, max(last, month_last)
+
+    def record(self, ledger_key, employee, day):
+        count, _ = self.month_loads[ledger_key].get(employee, (0, 0))
+        self.month_loads[ledger_key][employee] = (count + 1, day.toordinal())
+
+    def credits(self, pool_name):
+        if pool_name not in self.month_credits:
+            self.month_credits[pool_name] = list(self.start_credits.get(pool_name, [0.0] * 7))
+        return self.month_credits[pool_name]
+
+    def end_month(self, schedule, ledger_keys):
+        previous = self.months.get(self.current)
+        self.months[self.current] = {"loads": previous["loads"] if previous else {}, "credits": self.month_credits}
+        self.record_month(self.year, self.month, schedule, ledger_keys, changed=self.months[self.current] != previous)
+
+    # Replace a month's loads with who actually holds each pooled shift (ledger key) in the schedule
+    def record_month(self, year, month, schedule, ledger_keys, changed=False):
+        loads = {ledger_key: {} for ledger_key in ledger_keys}
+        for (day, employee), shift in sorted(schedule.items()):
+            if shift in loads:
+                count, _ = loads[shift].get(employee, (0, None))
+                loads[shift][employee] = [count + 1, day.isoformat()]
+        key = f"{year}-{month:02d}"
+        record = self.months.setdefault(key, {"credits": {}})
+        if changed or record.get("loads") != loads:
+            record["loads"] = loads
+            self.save(key)
+
+    def save(self, key):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{key}.json")
+        # Written aside and renamed, so a crash never leaves half a month behind
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.months[key], f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+# Least-loaded assignment of one duty. demand maps weekday -> people per day; fractional values
+# accumulate from day to day (0.5 on Fridays = every other Friday) instead of using coin flips.
+# With per_member the demand is per member of the pool. Pools sharing a ledger_key share their load counters
+class DutyPool:
+    def __init__(self, name, candidates, demand, ledger_key=None, min_gap=0, per_member=False):
+        self.name = name
+        self.candidates = candidates
+        self.demand = demand
+        self.ledger_key = ledger_key or name
+        self.min_gap = min_gap
+        self.per_member = per_member
+
+    # Only people whose (final) rule draws from this pool take part
+    def start_month(self, ledger, coworkers):
+        self.ledger = ledger
+        self.members = [emp for emp in self.candidates if self in getattr(coworkers.get(emp), "duty_pools", ())]
+        # (load, last assigned ordinal, position, employee): fewest duties first, then longest since the last one
+        self.heap = [ledger.load(self.ledger_key, emp) + (i, emp) for i, emp in enumerate(self.members)]
+        heapq.heapify(self.heap)
+        self.by_date = {}
+
+    # The people on this duty for a date; picked once, when the first member asks
+    def assigned(self, day, schedule):
+        if day not in self.by_date:
+            self.by_date[day] = self._pick(day, schedule)
+        return self.by_date[day]
+
+    def _pick(self, day, schedule):
+        credits = self.ledger.credits(self.name)
+        credits[day.weekday()] += self.demand.get(day.weekday(), 0) * (len(self.members) if self.per_member else 1)
+        need = int(credits[day.weekday()] + 1e-9)
+        credits[day.weekday()] -= need
+        picked = []
+        passed = []
+        while need and self.heap:
+            entry = heapq.heappop(self.heap)
+            load, last, position, emp = entry
+            # Another pool with the same ledger key may have assigned this person since the entry was pushed
+            current = self.ledger.load(self.ledger_key, emp)
+            if (load, last) != current:
+                heapq.heappush(self.heap, current + (position, emp))
+                continue
+            if schedule.get((day, emp)) != "工作" or (self.min_gap and last and day.toordinal() - last < self.min_gap):
+                passed.append(entry)
+                continue
+            self.ledger.record(self.ledger_key, emp, day)
+            picked.append((position, emp))
+            need -= 1
+        for entry in passed:
+            heapq.heappush(self.heap, entry)
+        for position, emp in picked:
+            heapq.heappush(self.heap, self.ledger.load(self.ledger_key, emp) + (position, emp))
+        return {emp for _, emp in picked}
+
 # Base class for rest rules
 class RestRule:
     def is_resting(self, date, rest_days=None):
@@ -35,6 +194,10 @@ class RestRule:
     def assign_shift(self, date, schedule, rest_days=None):
         pass
 
+    # Called by build_schedule before each month; rules with monthly counters reset them here
+    def start_month(self, year, month):
+        pass
+
 # Director Rule (work Mon-Fri, rest Sat-Sun, adjust for statutory holidays)
 class DirectorRule(RestRule):
     def is_resting(self, date, rest_days=None):
@@ -121,11 +284,11 @@ class WeekendRotationRule(RestRule):
 
 # Main Hospital Duty Rule (10 people)
 class MainHospitalDutyRule(RestRule):
-    def __init__(self, name, all_names):
+    def __init__(self, name, all_names, pool):
         self.name = name
         self.all_names = all_names
-        self.last_duty = None
-        self.duty_count = 0
+        self.pool = pool
+        self.duty_pools = (pool,)
 
     def is_resting(self, date, rest_days=None):
         return False
@@ -135,26 +298,18 @@ class MainHospitalDutyRule(RestRule):
         if current_shift in ["江东班", "开发班", "值班", "内勤", "外勤", "休息"]:
             return current_shift
 
-        if self.last_duty and (date - self.last_duty).days < 4:
-            return "工作"
-
-        if date.weekday() == 4:  # Friday
-            duty_cycle = cycle(self.all_names)
-            for _ in range(self.all_names.index(self.name)):
-                next(duty_cycle)
-            if next(duty_cycle) == self.name:
-                self.last_duty = date
-                self.duty_count += 1
-                return "值班"
+        # The pool keeps the 4-day gap using the last duty date from the ledger
+        if self.name in self.pool.assigned(date, schedule):
+            return "值班"
         return "工作"
 
 # Internal/External Duty Rule (7 people)
 class InternalExternalRule(RestRule):
-    def __init__(self, name, internal_group):
+    def __init__(self, name, internal_group, pool):
         self.name = name
         self.internal_group = internal_group
-        self.internal_days = 0
-        self.total_working_days = 0
+        self.pool = pool
+        self.duty_pools = (pool,)
 
     def is_resting(self, date, rest_days=None):
         return False
@@ -167,10 +322,7 @@ class InternalExternalRule(RestRule):
         if date.weekday() >= 5:  # Weekend
             return "外勤" if current_shift != "外勤" else current_shift
 
-        self.total_working_days += 1
-        target_internal_days = self.total_working_days // len(self.internal_group)  # Approx equal distribution
-        if self.internal_days < target_internal_days and random.random() < 0.4 and date not in rest_days:
-            self.internal_days += 1
+        if self.name in self.pool.assigned(date, schedule):
             return "内勤"
         return "外勤"
 
@@ -181,6 +333,10 @@ class DevelopmentDutyRule(RestRule):
         self.other_name = other_name
         self.days_assigned = 0
 
+    # DEV_DUTY_LIMIT is per month, and a month may be built again (e.g. after new leave)
+    def start_month(self, year, month):
+        self.days_assigned = 0
+
     def is_resting(self, date, rest_days=None):
         return False
 
@@ -189,7 +345,7 @@ class DevelopmentDutyRule(RestRule):
         if current_shift == "江东班" or date in rest_days:
             return current_shift
 
-        if self.days_assigned < 4 and date.weekday() in [2, 3, 4]:
+        if self.days_assigned < DEV_DUTY_LIMIT and date.weekday() in [2, 3, 4]:
             if schedule.get((date, self.other_name), "工作") != "开发班":
                 self.days_assigned += 1
                 return "开发班"
@@ -197,41 +353,190 @@ class DevelopmentDutyRule(RestRule):
 
 # Jiangdong Duty Rule (7 and 9 people)
 class JiangdongDutyRule(RestRule):
-    def __init__(self, name, group7, group9):
+    def __init__(self, name, group7, group9, pool7, pool9):
         self.name = name
         self.group7 = group7
         self.group9 = group9
-        self.group7_cycle = cycle(group7)
-        self.group9_cycle = cycle(group9)
+        self.pool7 = pool7
+        self.pool9 = pool9
+        self.duty_pools = (pool7, pool9)
 
     def is_resting(self, date, rest_days=None):
         return False
 
     def assign_shift(self, date, schedule, rest_days=None):
-        weekday = date.weekday()
-        if weekday in [0, 1] and self.name != "郭向彬":  # Mon, Tue
-            for _ in range(self.group9.index(self.name)):
-                next(self.group9_cycle)
-            if next(self.group9_cycle) == self.name and date not in rest_days:
-                return "江东班"
-        elif weekday in [2, 3, 4]:  # Wed, Thu, Fri
-            for _ in range(self.group7.index(self.name)):
-                next(self.group7_cycle)
-            if next(self.group7_cycle) == self.name and (weekday < 4 or random.random() < 0.5) and date not in rest_days:
-                return "江东班"
-        elif weekday >= 5:  # Weekend, 1 person
-            for _ in range(self.group7.index(self.name)):
-                next(self.group7_cycle)
-            if next(self.group7_cycle) == self.name and random.random() < 0.2 and date not in rest_days:
-                return "江东班"
+        # Mon/Tue come from the 9-person group, Wed-Sun from the 7-person group
+        pool = self.pool9 if date.weekday() in [0, 1] else self.pool7
+        if self.name in pool.assigned(date, schedule):
+            return "江东班"
         return "工作"
 
+# Minimum number of people not resting on each day, indexed by weekday (Mon..Sun)
+MIN_STAFF_PER_DAY = (8, 8, 8, 8, 8, 6, 6)
+
+# Minimum number of people per shift type on each day
+MIN_STAFF_PER_SHIFT = {"工作": 2}
+
+# Weekly rest allocation (Step 5): missing rest days go to the most-staffed days first
+class RestAllocator:
+    def __init__(self, min_staff_per_day=MIN_STAFF_PER_DAY, min_staff_per_shift=MIN_STAFF_PER_SHIFT, rest_per_week=REST_PER_WEEK):
+        self.min_staff_per_day = min_staff_per_day
+        self.min_staff_per_shift = min_staff_per_shift
+        self.rest_per_week = rest_per_week
+
+    def allocate(self, schedule, rest_days, dates, employees):
+        # Per-day coverage (people not resting) and per-day, per-shift head counts
+        all_employees = {emp for (_, emp) in schedule}
+        coverage = {d: 0 for d in dates}
+        shift_count = Counter()
+        for d in dates:
+            for emp in all_employees:
+                shift = schedule[(d, emp)]
+                shift_count[(d, shift)] += 1
+                if shift not in OFF_SHIFTS:
+                    coverage[d] += 1
+
+        # Group the month's dates into Monday-based weeks in a single pass
+        weeks = defaultdict(list)
+        offset = dates[0].weekday()
+        for d in dates:
+            weeks[((d - dates[0]).days + offset) // 7].append(d)
+
+        for week_dates in weeks.values():
+            # Rest days still owed this week, and who could take each day off
+            need = {}
+            candidates = defaultdict(list)
+            for emp in employees:
+                rest_count = sum(1 for d in week_dates if schedule[(d, emp)] == "休息")
+                if rest_count >= self.rest_per_week:
+                    continue
+                need[emp] = self.rest_per_week - rest_count
+                for d in week_dates:
+                    if schedule[(d, emp)] == "工作" and d not in rest_days[emp]:
+                        candidates[d].append(emp)
+            # Seeded by the week so that building a month again gives the same rest days
+            rng = random.Random(week_dates[0].toordinal())
+            for bucket in candidates.values():
+                rng.shuffle(bucket)
+
+            # Max-heap on coverage; each day is in the heap at most once
+            heap = [(-coverage[d], d) for d in candidates]
+            heapq.heapify(heap)
+            while heap and need:
+                _, d = heapq.heappop(heap)
+                if not self._can_release(d, coverage, shift_count):
+                    continue
+                bucket = candidates[d]
+                while bucket and bucket[-1] not in need:
+                    bucket.pop()
+                if not bucket:
+                    continue
+                emp = bucket.pop()
+                schedule[(d, emp)] = "休息"
+                rest_days[emp].add(d)
+                coverage[d] -= 1
+                shift_count[(d, "工作")] -= 1
+                shift_count[(d, "休息")] += 1
+                need[emp] -= 1
+                if not need[emp]:
+                    del need[emp]
+                heapq.heappush(heap, (-coverage[d], d))
+
+    # Whether one more person working "工作" on this day may take it off
+    def _can_release(self, d, coverage, shift_count):
+        if coverage[d] - 1 < self.min_staff_per_day[d.weekday()]:
+            return False
+        return shift_count[(d, "工作")] - 1 >= self.min_staff_per_shift.get("工作", 0)
+
+# Absences (annual leave, sick leave, training) as date ranges per employee.
+# Each month is compiled once into per-employee bitmaps: bit (day - 1) is set on leave days
+class LeaveCalendar:
+    def __init__(self, entries=None):
+        self.entries = []
+        self.compiled = {}
+        for entry in entries or []:
+            self.add(*entry)
+
+    def add(self, employee, start, end, kind="年假"):
+        if kind not in LEAVE_TYPES:
+            raise ValueError(f"未知的请假类型: {kind}")
+        if end < start:
+            raise ValueError("请假结束日期早于开始日期")
+        self.entries.append((employee, start, end, kind))
+        self.compiled.clear()
+
+    # (year, month) pairs touched by a leave range, so callers know what to regenerate
+    @staticmethod
+    def months_of(start, end):
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            yield year, month
+            month += 1
+            if month > 12:
+                year, month = year + 1, 1
+
+    # {employee: bitmap} and {(date, employee): kind} for one month
+    def month_bitmaps(self, year, month):
+        key = (year, month)
+        if key not in self.compiled:
+            first = date(year, month, 1)
+            last = date(year, month, calendar.monthrange(year, month)[1])
+            bits = {}
+            kinds = {}
+            for employee, start, end, kind in self.entries:
+                if end < first or start > last:
+                    continue
+                lo = max(start, first).day
+                hi = min(end, last).day
+                # Set bits lo-1 .. hi-1 in one operation
+                bits[employee] = bits.get(employee, 0) | (((1 << (hi - lo + 1)) - 1) << (lo - 1))
+                for day in range(lo, hi + 1):
+                    kinds[(date(year, month, day), employee)] = kind
+            self.compiled[key] = (bits, kinds)
+        return self.compiled[key]
+
+    def save(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["employee", "start", "end", "type"])
+            for employee, start, end, kind in self.entries:
+                writer.writerow([employee, start.isoformat(), end.isoformat(), kind])
+
+# Read absences from a CSV (employee,start,end,type) or JSON list of objects with the same keys
+def load_leave_file(path, leave=None):
+    leave = leave or LeaveCalendar()
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+    for row in rows:
+        end = row.get("end") or row["start"]
+        leave.add(row["employee"], date.fromisoformat(row["start"]), date.fromisoformat(end), row.get("type") or "年假")
+    return leave
+
+def on_leave(leave_bits, employee, day):
+    return leave_bits.get(employee, 0) >> (day - 1) & 1
+
 # Groups for rotations
 main_hospital_duty_names = ["楼峰", "张捷", "郭向彬", "周艺慧", "王振滨", "袁雷武", "章杰", "陈荣盛", "傅舒娜", "张家栋"]
 internal_group = ["周艺慧", "王振滨", "袁雷武", "章杰", "陈荣盛", "傅舒娜", "张家栋"]
 jiangdong_group7 = ["楼峰", "张捷", "周艺慧", "王振滨", "袁雷武", "陈荣盛", "张家栋"]
 jiangdong_group9 = ["楼峰", "张捷", "郭向彬", "周艺慧", "王振滨", "袁雷武", "章杰", "陈荣盛", "张家栋"]
 
+# Used when build_schedule is not given a ledger; keeps counts for the life of the process
+default_ledger = FairnessLedger()
+
+# Duty pools; people per weekday (Mon..Sun), fractions spread over weeks
+main_duty_pool = DutyPool("值班", main_hospital_duty_names, {4: 1}, min_gap=DUTY_MIN_GAP)
+# 郭向彬 does not take the Mon/Tue 江东班
+jiangdong_pool9 = DutyPool("江东班-9", [n for n in jiangdong_group9 if n != "郭向彬"], {0: 1, 1: 1}, ledger_key="江东班")
+jiangdong_pool7 = DutyPool("江东班-7", jiangdong_group7, {2: 1, 3: 1, 4: 0.5, 5: 0.2, 6: 0.2}, ledger_key="江东班")
+# Each member does 内勤 on about one working day in len(internal_group)
+internal_pool = DutyPool("内勤", internal_group, {weekday: 1 / len(internal_group) for weekday in range(5)},
+                         per_member=True)
+
 # Coworkers with specific rules
 coworkers = {
     "袁铄慧": DirectorRule(),
@@ -245,62 +550,66 @@ coworkers = {
     "陈荣盛": WeekendRotationRule("陈荣盛", "楼峰", cycle([True, False, False])),
     "王振滨": WeekendRotationRule("王振滨", "章杰", cycle([False, False, True])),
     "章杰": WeekendRotationRule("章杰", "王振滨", cycle([False, False, True])),
-    "郭向彬": MainHospitalDutyRule("郭向彬", main_hospital_duty_names),
-    "周艺慧": MainHospitalDutyRule("周艺慧", main_hospital_duty_names),
-    "傅舒娜": MainHospitalDutyRule("傅舒娜", main_hospital_duty_names),
-    "张家栋": MainHospitalDutyRule("张家栋", main_hospital_duty_names),
+    "郭向彬": MainHospitalDutyRule("郭向彬", main_hospital_duty_names, main_duty_pool),
+    "周艺慧": MainHospitalDutyRule("周艺慧", main_hospital_duty_names, main_duty_pool),
+    "傅舒娜": MainHospitalDutyRule("傅舒娜", main_hospital_duty_names, main_duty_pool),
+    "张家栋": MainHospitalDutyRule("张家栋", main_hospital_duty_names, main_duty_pool),
 }
 
 # Add internal/external and Jiangdong rules
 for name in internal_group:
-    coworkers[name] = InternalExternalRule(name, internal_group)
+    coworkers[name] = InternalExternalRule(name, internal_group, internal_pool)
 
 for name in jiangdong_group7:
-    coworkers[name] = JiangdongDutyRule(name, jiangdong_group7, jiangdong_group9)
+    coworkers[name] = JiangdongDutyRule(name, jiangdong_group7, jiangdong_group9, jiangdong_pool7, jiangdong_pool9)
 
 # Add development duty for 章杰 and 张家栋
 coworkers["章杰"] = DevelopmentDutyRule("章杰", "张家栋")
 coworkers["张家栋"] = DevelopmentDutyRule("张家栋", "章杰")
 
-# Generate the schedule with days as columns and employees as rows
-def generate_schedule(year, month, coworkers):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"{MONTH_NAMES[month-1]} {year}"
-
-    # Write headers
-    # Row 1: Day of month with "天" in column 1
-    ws.cell(row=1, column=1, value="天")
-    ws.cell(row=1, column=1).font = Font(bold=True)
+# The duty pools the rules draw from, in rule order
+def duty_pools(coworkers):
+    pools = []
+    for rule in coworkers.values():
+        for pool in getattr(rule, "duty_pools", ()):
+            if pool not in pools:
+                pools.append(pool)
+    return pools
+
+# Compute the shifts for one month as a {(date, employee): shift} dictionary
+def build_schedule(year, month, coworkers, rest_allocator=None, leave=None, rotations=None, ledger=None):
     num_days = calendar.monthrange(year, month)[1]
-    for day in range(1, num_days + 1):
-        current_date = date(year, month, day)
-        cell = ws.cell(row=1, column=day + 1, value=day)
-        cell.font = Font(bold=True)
-        if current_date.weekday() >= 5:  # Saturday or Sunday
-            cell.fill = YELLOW_FILL
-        else:
-            cell.fill = BLUE_FILL
-
-    # Row 2: Weekdays with "星期" in column 1
-    ws.cell(row=2, column=1, value="星期")
-    ws.cell(row=2, column=1).font = Font(bold=True)
-    for day in range(1, num_days + 1):
-        current_date = date(year, month, day)
-        weekday = WEEKDAYS[current_date.weekday()]
-        cell = ws.cell(row=2, column=day + 1, value=weekday)
-        cell.font = Font(bold=True)
 
     # Initialize schedule dictionary
     schedule = {(date(year, month, day), emp): "工作" for day in range(1, num_days + 1) for emp in coworkers.keys()}
     rest_days = {emp: set() for emp in coworkers.keys()}  # Track rest days per employee
 
+    # Reserve leave days first; every step below skips them with a single bit test
+    leave_bits, leave_kinds = leave.month_bitmaps(year, month) if leave else ({}, {})
+    for (leave_date, employee), kind in leave_kinds.items():
+        if employee in coworkers:
+            schedule[(leave_date, employee)] = kind
+
+    # Duty pools pick the least-loaded members, counting the months already in the ledger
+    ledger = ledger or default_ledger
+    ledger.begin_month(year, month)
+    pools = duty_pools(coworkers)
+    for pool in pools:
+        pool.start_month(ledger, coworkers)
+    for rule in coworkers.values():
+        rule.start_month(year, month)
+
     # Assign shifts in priority order: Weekend > Internal/Jiangdong/Development > External
     # Step 1: Directors and Weekend shifts
+    # Employees covered by declarative rotations (rotation.RotationSet) get the whole month at once
+    if rotations is not None:
+        rotations.apply(schedule, rest_days, [date(year, month, day) for day in range(1, num_days + 1)], leave_bits)
     for day in range(1, num_days + 1):
         current_date = date(year, month, day)
         for employee, rule in coworkers.items():
             if isinstance(rule, (DirectorRule, WeekendRotationRule, JiangdongWeekendRule)):
+                if on_leave(leave_bits, employee, day) or (rotations is not None and employee in rotations):
+                    continue
                 shift = rule.assign_shift(current_date, schedule, rest_days.get(employee))
                 if shift:
                     schedule[(current_date, employee)] = shift
@@ -312,6 +621,8 @@ def generate_schedule(year, month, coworkers):
         current_date = date(year, month, day)
         for employee, rule in coworkers.items():
             if isinstance(rule, (JiangdongDutyRule, DevelopmentDutyRule)):
+                if on_leave(leave_bits, employee, day):
+                    continue
                 shift = rule.assign_shift(current_date, schedule, rest_days.get(employee))
                 if shift:
                     schedule[(current_date, employee)] = shift
@@ -323,6 +634,8 @@ def generate_schedule(year, month, coworkers):
         current_date = date(year, month, day)
         for employee, rule in coworkers.items():
             if isinstance(rule, MainHospitalDutyRule):
+                if on_leave(leave_bits, employee, day):
+                    continue
                 shift = rule.assign_shift(current_date, schedule, rest_days.get(employee))
                 if shift:
                     schedule[(current_date, employee)] = shift
@@ -334,6 +647,8 @@ def generate_schedule(year, month, coworkers):
         current_date = date(year, month, day)
         for employee, rule in coworkers.items():
             if isinstance(rule, InternalExternalRule):
+                if on_leave(leave_bits, employee, day):
+                    continue
                 shift = rule.assign_shift(current_date, schedule, rest_days.get(employee))
                 if shift:
                     schedule[(current_date, employee)] = shift
@@ -341,46 +656,79 @@ def generate_schedule(year, month, coworkers):
                         rest_days[employee].add(current_date)
 
     # Step 5: Ensure two rest days per week for non-directors
-    first_date = date(year, month, 1)
-    last_date = date(year, month, num_days)
-    for employee in coworkers.keys():
-        if isinstance(coworkers[employee], DirectorRule):
-            continue
-        # Generate week start dates within the month
-        week_starts = []
-        current_date = first_date
-        while current_date <= last_date:
-            # Adjust week start to Monday (weekday 0)
-            week_start = current_date - timedelta(days=current_date.weekday())
-            if week_start < first_date:
-                week_start = first_date
-            if week_start <= last_date:
-                week_starts.append(week_start)
-            current_date += timedelta(days=7)
-
-        for week_start in set(week_starts):
-            # Only include dates within the current month
-            week_dates = [
-                week_start + timedelta(days=i)
-                for i in range(7)
-                if (week_start + timedelta(days=i)).month == month
-                and first_date <= (week_start + timedelta(days=i)) <= last_date
-            ]
-            if not week_dates:
-                continue
-            rest_count = sum(1 for d in week_dates if schedule[(d, employee)] == "休息")
-            while rest_count < 2 and week_dates:
-                available_dates = [d for d in week_dates if schedule[(d, employee)] == "工作" and d not in rest_days[employee]]
-                if available_dates:
-                    rest_date = random.choice(available_dates)
-                    schedule[(rest_date, employee)] = "休息"
-                    rest_days[employee].add(rest_date)
-                    rest_count += 1
-                else:
+    dates = [date(year, month, day) for day in range(1, num_days + 1)]
+    employees = [emp for emp, rule in coworkers.items() if not isinstance(rule, DirectorRule)]
+    (rest_allocator or RestAllocator()).allocate(schedule, rest_days, dates, employees)
+
+    ledger.end_month(schedule, {pool.ledger_key for pool in pools})
+    return schedule
+
+# Check one employee's week after an edit; returns a list of problems (empty when valid).
+# Only cells of this employee, plus 开发班 partners on the same days, are looked at
+def validate_week(schedule, employee, week_dates, coworkers):
+    problems = []
+    rule = coworkers.get(employee)
+    # Leave days are days off too
+    rests = sum(1 for d in week_dates if schedule.get((d, employee)) in OFF_SHIFTS)
+    if not isinstance(rule, DirectorRule) and rests < min(REST_PER_WEEK, len(week_dates)):
+        problems.append(f"本周休息少于{REST_PER_WEEK}天")
+    for d in week_dates:
+        shift = schedule.get((d, employee))
+        # Directors only work or rest, as in swaps.ConstraintIndex
+        if isinstance(rule, DirectorRule) and shift not in ["工作", "休息"] + LEAVE_TYPES:
+            problems.append(f"{d.month}月{d.day}日不应安排{shift}（不参与排班轮值）")
+        if shift == "值班":
+            # Later duties are caught when the loop reaches them, so only look back
+            for gap in range(1, DUTY_MIN_GAP):
+                if gap == 1 and d.weekday() == 6:
+                    continue  # Saturday of the same weekend duty
+                if schedule.get((d - timedelta(days=gap), employee)) == "值班":
+                    problems.append(f"{d.month}月{d.day}日值班距上次值班不足{DUTY_MIN_GAP}天")
                     break
+        elif shift == "开发班":
+            if not isinstance(rule, DevelopmentDutyRule):
+                problems.append(f"{d.month}月{d.day}日不应安排开发班")
+            elif schedule.get((d, rule.other_name)) == "开发班":
+                problems.append(f"{d.month}月{d.day}日开发班重复")
+        if shift not in SHIFT_TYPES:
+            problems.append(f"{d.month}月{d.day}日班次无效")
+    return problems
+
+# Write a computed schedule to a workbook with days as columns and employees as rows.
+# Pass an existing workbook to add the month as another sheet
+def schedule_to_workbook(year, month, schedule, employees, wb=None):
+    if wb is None:
+        wb = openpyxl.Workbook()
+        ws = wb.active
+    else:
+        ws = wb.create_sheet()
+    ws.title = f"{MONTH_NAMES[month-1]} {year}"
+
+    # Write headers
+    # Row 1: Day of month with "天" in column 1
+    ws.cell(row=1, column=1, value="天")
+    ws.cell(row=1, column=1).font = Font(bold=True)
+    num_days = calendar.monthrange(year, month)[1]
+    for day in range(1, num_days + 1):
+        current_date = date(year, month, day)
+        cell = ws.cell(row=1, column=day + 1, value=day)
+        cell.font = Font(bold=True)
+        if current_date.weekday() >= 5:  # Saturday or Sunday
+            cell.fill = YELLOW_FILL
+        else:
+            cell.fill = BLUE_FILL
+
+    # Row 2: Weekdays with "星期" in column 1
+    ws.cell(row=2, column=1, value="星期")
+    ws.cell(row=2, column=1).font = Font(bold=True)
+    for day in range(1, num_days + 1):
+        current_date = date(year, month, day)
+        weekday = WEEKDAYS[current_date.weekday()]
+        cell = ws.cell(row=2, column=day + 1, value=weekday)
+        cell.font = Font(bold=True)
 
     # Fill schedule for each employee (starting from row 3)
-    for row, (employee, rule) in enumerate(coworkers.items(), start=3):
+    for row, employee in enumerate(employees, start=3):
         ws.cell(row=row, column=1, value=employee)
         for day in range(1, num_days + 1):
             current_date = date(year, month, day)
@@ -392,4 +740,11 @@ def generate_schedule(year, month, coworkers):
             else:
                 cell.value = status
 
-    return wb
\ No newline at end of file
+    return wb
+
+# Generate the schedule with days as columns and employees as rows, with the same Step 1 rotations as the apps
+def generate_schedule(year, month, coworkers):
+    # rotation imports this module, so it can only be imported once both are loaded
+    from rotation import RotationSet
+    schedule = build_schedule(year, month, coworkers, rotations=RotationSet.from_coworkers(coworkers))
+    return schedule_to_workbook(year, month, schedule, list(coworkers.keys()))
\ No newline at end of file
@@ -1,22 +1,33 @@
+import os
 import sys
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                               QComboBox, QSpinBox, QPushButton, QFileDialog, QLabel)
+                               QComboBox, QSpinBox, QPushButton, QFileDialog, QLabel,
+                               QTableView, QHeaderView, QMessageBox)
 from PySide6.QtCore import Qt
-from datetime import datetime
+from datetime import datetime, date
 import calendar
-from common import generate_schedule, coworkers, MONTH_NAMES
+import openpyxl
+from common import (build_schedule, schedule_to_workbook, load_leave_file, coworkers, duty_pools, FairnessLedger,
+                    MONTH_NAMES)
+from roster_model import RosterModel, ShiftDelegate
+from rotation import RotationSet
+
+# Step 1 rotations compiled per month instead of evaluated day by day
+rotations = RotationSet.from_coworkers(coworkers)
+
+# Duty counts carried from month to month, kept next to the program
+ledger = FairnessLedger(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fairness"))
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("生成排班表")
-        self.setGeometry(100, 100, 450, 250)  # Adjusted size for better layout
+        self.setGeometry(100, 100, 1000, 700)  # Room for the roster table
 
         # Central widget and layout
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         layout = QVBoxLayout(central_widget)
-        layout.setAlignment(Qt.AlignCenter)
         layout.setSpacing(20)
 
         # Month selection
@@ -60,6 +71,43 @@ class MainWindow(QMainWindow):
         """)
         layout.addWidget(self.year_spin)
 
+        # Number of months shown in the roster
+        self.months_label = QLabel("月数:")
+        self.months_label.setStyleSheet("font-weight: bold; font-size: 16px; color: #2c3e50;")
+        layout.addWidget(self.months_label)
+
+        self.months_spin = QSpinBox()
+        self.months_spin.setRange(1, 12)
+        self.months_spin.setStyleSheet("""
+            QSpinBox {
+                padding: 8px;
+                font-size: 14px;
+                border: 2px solid #dfe6e9;
+                border-radius: 5px;
+            }
+            QSpinBox:hover {
+                border-color: #3498db;
+            }
+        """)
+        layout.addWidget(self.months_spin)
+
+        # Leave file (annual leave, sick leave, training) applied when generating
+        self.leave = None
+        self.leave_button = QPushButton("导入请假")
+        self.leave_button.setStyleSheet("""
+            QPushButton {
+                padding: 8px;
+                font-size: 14px;
+                border: 2px solid #dfe6e9;
+                border-radius: 5px;
+            }
+            QPushButton:hover {
+                border-color: #3498db;
+            }
+        """)
+        self.leave_button.clicked.connect(self.load_leave)
+        layout.addWidget(self.leave_button)
+
         # Generate button
         self.generate_button = QPushButton("生成排班表")
         self.generate_button.setStyleSheet("""
@@ -79,6 +127,23 @@ class MainWindow(QMainWindow):
         self.generate_button.clicked.connect(self.generate_schedule)
         layout.addWidget(self.generate_button)
 
+        # Roster table; only the visible cells are ever drawn
+        self.roster_view = QTableView()
+        self.roster_view.setItemDelegate(ShiftDelegate(self.roster_view))
+        self.roster_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.roster_view.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.roster_view.horizontalHeader().setDefaultSectionSize(56)
+        self.roster_view.setEditTriggers(QTableView.DoubleClicked | QTableView.EditKeyPressed)
+        layout.addWidget(self.roster_view, 1)
+        self.roster_model = None
+
+        # Save button
+        self.save_button = QPushButton("保存排班表")
+        self.save_button.setStyleSheet(self.generate_button.styleSheet())
+        self.save_button.setEnabled(False)
+        self.save_button.clicked.connect(self.save_schedule)
+        layout.addWidget(self.save_button)
+
         # Status label
         self.status_label = QLabel("")
         self.status_label.setAlignment(Qt.AlignCenter)
@@ -96,16 +161,72 @@ class MainWindow(QMainWindow):
         self.status_label.setText("正在生成排班表...")
         QApplication.processEvents()  # Update GUI
 
-        wb = generate_schedule(year, month, coworkers)
+        # Build each month and join them into one schedule for the table
+        self.months = []
+        schedule = {}
+        for _ in range(self.months_spin.value()):
+            self.months.append((year, month))
+            schedule.update(build_schedule(year, month, coworkers, leave=self.leave, rotations=rotations, ledger=ledger))
+            month += 1
+            if month > 12:
+                year, month = year + 1, 1
+        first_year, first_month = self.months[0]
+        last_year, last_month = self.months[-1]
+        first = date(first_year, first_month, 1)
+        last = date(last_year, last_month, calendar.monthrange(last_year, last_month)[1])
+        dates = [date.fromordinal(n) for n in range(first.toordinal(), last.toordinal() + 1)]
+
+        self.roster_model = RosterModel(schedule, list(coworkers.keys()), dates, coworkers, self)
+        self.roster_view.setModel(self.roster_model)
+        self.save_button.setEnabled(True)
+        self.status_label.setText("排班表已生成，双击单元格可修改")
+
+    def load_leave(self):
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "导入请假", "", "Leave Files (*.csv *.json)"
+        )
+        if not file_path:
+            return
+        try:
+            self.leave = load_leave_file(file_path)
+        except (OSError, KeyError, ValueError) as e:
+            QMessageBox.warning(self, "导入请假失败", str(e))
+            return
+        self.leave_button.setText(f"请假: {len(self.leave.entries)} 条")
+        self.status_label.setText(f"已导入请假 {file_path}")
+
+    def save_schedule(self):
+        if self.roster_model is None:
+            return
+        # Edited weeks were re-validated as they changed; confirm before exporting a roster with problems
+        problems = self.roster_model.all_problems()
+        if problems:
+            answer = QMessageBox.question(
+                self, "排班表存在问题", "\n".join(problems[:20]) + "\n\n仍要保存吗？"
+            )
+            if answer != QMessageBox.Yes:
+                return
+
+        first_year, first_month = self.months[0]
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "保存排班表", f"schedule_{year}_{month}.xlsx", "Excel Files (*.xlsx)"
+            self, "保存排班表", f"schedule_{first_year}_{first_month}.xlsx", "Excel Files (*.xlsx)"
         )
-        
+
         if file_path:
+            # One sheet per month
+            wb = openpyxl.Workbook()
+            wb.remove(wb.active)
+            ledger_keys = {pool.ledger_key for pool in duty_pools(coworkers)}
+            for year, month in self.months:
+                schedule_to_workbook(year, month, self.roster_model.schedule, self.roster_model.employees, wb)
+                # Hand edits change who holds the duties; later months are balanced against the saved roster
+                month_schedule = {(d, emp): shift for (d, emp), shift in self.roster_model.schedule.items()
+                                  if (d.year, d.month) == (year, month)}
+                ledger.record_month(year, month, month_schedule, ledger_keys)
             wb.save(file_path)
             self.status_label.setText(f"排班表已保存至 {file_path}")
         else:
-            self.status_label.setText("生成已取消")
+            self.status_label.setText("保存已取消")
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,128 @@
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PySide6.QtGui import QBrush, QColor
+from PySide6.QtWidgets import QComboBox, QStyledItemDelegate
+from datetime import timedelta
+from common import (WEEKDAYS, SHIFT_TYPES, GREEN_FILL, BLUE_FILL, YELLOW_FILL, DUTY_MIN_GAP, validate_week)
+
+# openpyxl stores colors as ARGB; Qt wants #RRGGBB
+def fill_color(fill):
+    return QColor("#" + fill.start_color.rgb[-6:])
+
+# Table model reading straight from the {(date, employee): shift} dictionary.
+# QTableView only asks for visible cells, so the cost does not grow with the roster size
+class RosterModel(QAbstractTableModel):
+    def __init__(self, schedule, employees, dates, coworkers, parent=None):
+        super().__init__(parent)
+        self.schedule = schedule
+        self.employees = employees
+        self.dates = dates
+        self.coworkers = coworkers
+        # Brushes are created once and shared by every cell
+        self.rest_brush = QBrush(fill_color(GREEN_FILL))
+        self.weekday_brush = QBrush(fill_color(BLUE_FILL))
+        self.weekend_brush = QBrush(fill_color(YELLOW_FILL))
+        self.problem_brush = QBrush(QColor("#c0392b"))
+        # (employee, week start) -> problems found by the last validation of that week
+        self.problems = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.employees)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.dates)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        employee = self.employees[index.row()]
+        current_date = self.dates[index.column()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.schedule[(current_date, employee)]
+        if role == Qt.BackgroundRole:
+            if self.schedule[(current_date, employee)] == "休息":
+                return self.rest_brush
+            return None
+        problems = self.problems.get((employee, week_start(current_date)))
+        if problems:
+            if role == Qt.ForegroundRole:
+                return self.problem_brush
+            if role == Qt.ToolTipRole:
+                return "\n".join(problems)
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Vertical:
+            if role == Qt.DisplayRole:
+                return self.employees[section]
+            return None
+        current_date = self.dates[section]
+        if role == Qt.DisplayRole:
+            return f"{current_date.month}/{current_date.day}\n{WEEKDAYS[current_date.weekday()]}"
+        if role == Qt.BackgroundRole:
+            return self.weekend_brush if current_date.weekday() >= 5 else self.weekday_brush
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.EditRole or not index.isValid() or value not in SHIFT_TYPES:
+            return False
+        employee = self.employees[index.row()]
+        current_date = self.dates[index.column()]
+        if self.schedule[(current_date, employee)] == value:
+            return False
+        self.schedule[(current_date, employee)] = value
+        # Only this employee's week changes; a 开发班 edit can also affect the partner's week
+        self.revalidate(employee, current_date)
+        # validate_week looks back for earlier 值班, so a day close to Sunday also affects next week
+        if current_date.weekday() >= 7 - (DUTY_MIN_GAP - 1):
+            self.revalidate(employee, current_date + timedelta(days=7))
+        rule = self.coworkers.get(employee)
+        partner = getattr(rule, "other_name", None)
+        if partner in self.coworkers:
+            self.revalidate(partner, current_date)
+        return True
+
+    # Re-check one employee's week and repaint just that row segment
+    def revalidate(self, employee, current_date):
+        start = week_start(current_date)
+        week_dates = [d for d in (start + timedelta(days=i) for i in range(7)) if (d, employee) in self.schedule]
+        problems = validate_week(self.schedule, employee, week_dates, self.coworkers)
+        key = (employee, start)
+        if problems:
+            self.problems[key] = problems
+        else:
+            self.problems.pop(key, None)
+        row = self.employees.index(employee)
+        columns = [self.column_of(d) for d in week_dates]
+        if columns:
+            self.dataChanged.emit(self.index(row, min(columns)), self.index(row, max(columns)))
+
+    def column_of(self, current_date):
+        return (current_date - self.dates[0]).days
+
+    def all_problems(self):
+        return [f"{employee} {start.month}月{start.day}日所在周: {problem}"
+                for (employee, start), problems in sorted(self.problems.items(), key=lambda item: item[0][1])
+                for problem in problems]
+
+def week_start(current_date):
+    return current_date - timedelta(days=current_date.weekday())
+
+# Drop-down editor limited to the known shift types
+class ShiftDelegate(QStyledItemDelegate):
+    def createEditor(self, parent, option, index):
+        editor = QComboBox(parent)
+        editor.addItems(SHIFT_TYPES)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data(Qt.EditRole))
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
@@ -0,0 +1,234 @@
+import numpy as np
+from datetime import date
+from common import (DirectorRule, JiangdongWeekendRule, WeekendRotationRule, STATUTORY_HOLIDAYS,
+                    WEEKDAYS, on_leave)
+
+# Declarative rotation rules, compiled into NumPy boolean masks over a whole month or year.
+#
+# A rule is written as space-separated key=value pairs, for example
+#   shift=值班 weekdays=六,日 parity=odd compensate=四,五@-1 priority=10
+# Keys:
+#   shift       value written on matching days (required)
+#   weekdays    weekday mask, 一..日 or 0..6 (default: every day)
+#   period      rule applies every N weeks (default 1)
+#   phase       which week of the period, 0..period-1 (default 0)
+#   parity      even / odd ISO week number (default: any)
+#   holidays    keep (ignore holidays), skip (never on a holiday) or only (only on holidays)
+#   priority    higher priority wins where rules overlap (default 0)
+#   compensate  rest days for each active week: weekdays@week offset, e.g. 四,五@-1 for Thu/Fri of the week before
+
+def _weekday(ordinals):
+    return (ordinals - 1) % 7
+
+def _iso_week(ordinals):
+    # ISO week 1 starts on the Monday of the week containing January 4th
+    weeks = np.empty_like(ordinals)
+    years = range(date.fromordinal(int(ordinals.min())).year - 1, date.fromordinal(int(ordinals.max())).year + 2)
+    starts = {}
+    for year in years:
+        jan4 = date(year, 1, 4).toordinal()
+        starts[year] = jan4 - _weekday(jan4)
+    for year in years:
+        if year + 1 not in starts:
+            continue
+        in_year = (ordinals >= starts[year]) & (ordinals < starts[year + 1])
+        weeks[in_year] = (ordinals[in_year] - starts[year]) // 7 + 1
+    return weeks
+
+# Calendar arrays for a date range, computed once and shared by every rule compiled over it
+class Horizon:
+    def __init__(self, start, end, holidays=STATUTORY_HOLIDAYS):
+        self.ordinals = np.arange(start.toordinal(), end.toordinal() + 1, dtype=np.int64)
+        self.weekday = _weekday(self.ordinals)
+        # Week index counted from the Monday date.fromordinal(1), so the period phase does not reset every year
+        self.week_index = (self.ordinals - 1) // 7
+        self.holiday_mask = np.isin(self.ordinals, [d.toordinal() for d in holidays])
+        self._iso_parity = {}
+
+    # ISO week parity of the week `offset` weeks before each day (offset 0 = the day's own week)
+    def iso_parity(self, offset=0):
+        if offset not in self._iso_parity:
+            self._iso_parity[offset] = _iso_week(self.ordinals - 7 * offset) % 2
+        return self._iso_parity[offset]
+
+def _parse_weekdays(text):
+    days = []
+    for part in text.split(","):
+        part = part.strip()
+        days.append(WEEKDAYS.index(part) if part in WEEKDAYS else int(part))
+    return tuple(days)
+
+class RotationRule:
+    def __init__(self, shift, weekdays=range(7), period=1, phase=0, parity=None, holidays="keep",
+                 priority=0, compensate=None, compensate_offset=0):
+        if holidays not in ("keep", "skip", "only"):
+            raise ValueError(f"unknown holiday handling: {holidays}")
+        if parity not in (None, "even", "odd"):
+            raise ValueError(f"unknown week parity: {parity}")
+        if not 0 <= phase < period:
+            raise ValueError("phase must be between 0 and period - 1")
+        self.shift = shift
+        self.weekdays = tuple(weekdays)
+        self.period = period
+        self.phase = phase
+        self.parity = parity
+        self.holidays = holidays
+        self.priority = priority
+        self.compensate = tuple(compensate) if compensate else ()
+        self.compensate_offset = compensate_offset
+
+    @classmethod
+    def parse(cls, text):
+        options = {}
+        for token in text.split():
+            key, _, value = token.partition("=")
+            if key == "weekdays":
+                options["weekdays"] = _parse_weekdays(value)
+            elif key in ("period", "phase", "priority"):
+                options[key] = int(value)
+            elif key in ("shift", "parity", "holidays"):
+                options[key] = value
+            elif key == "compensate":
+                days, _, offset = value.partition("@")
+                options["compensate"] = _parse_weekdays(days)
+                options["compensate_offset"] = int(offset or 0)
+            else:
+                raise ValueError(f"unknown rotation key: {key}")
+        if "shift" not in options:
+            raise ValueError(f"rotation rule without shift: {text}")
+        return cls(**options)
+
+    # Weeks in which the rule is active, evaluated for every day at once;
+    # offset shifts the test to the week that many weeks earlier
+    def week_mask(self, horizon, offset=0):
+        mask = (horizon.week_index - offset) % self.period == self.phase
+        if self.parity is not None:
+            mask &= horizon.iso_parity(offset) == (0 if self.parity == "even" else 1)
+        return mask
+
+    def day_mask(self, horizon):
+        weekday_mask = np.zeros(7, dtype=bool)
+        weekday_mask[list(self.weekdays)] = True
+        mask = weekday_mask[horizon.weekday] & self.week_mask(horizon)
+        if self.holidays == "skip":
+            mask &= ~horizon.holiday_mask
+        elif self.holidays == "only":
+            mask &= horizon.holiday_mask
+        return mask
+
+    # Rest days owed for active weeks: the compensating weekdays of the week shifted by the offset
+    def compensate_mask(self, horizon):
+        if not self.compensate:
+            return None
+        weekday_mask = np.zeros(7, dtype=bool)
+        weekday_mask[list(self.compensate)] = True
+        return weekday_mask[horizon.weekday] & self.week_mask(horizon, self.compensate_offset)
+
+# One employee's rules compiled over a date range: a code per day (-1 = no rule applies)
+class CompiledRotation:
+    def __init__(self, ordinals, codes, shifts):
+        self.ordinals = ordinals
+        self.codes = codes
+        self.shifts = shifts
+
+    def items(self):
+        for i in np.flatnonzero(self.codes >= 0):
+            yield date.fromordinal(int(self.ordinals[i])), self.shifts[self.codes[i]]
+
+def compile_rules(rules, horizon):
+    codes = np.full(len(horizon.ordinals), -1, dtype=np.int8)
+    shifts = []
+    # Lower priorities first so higher ones overwrite them; a duty beats its own rest days
+    for rule in sorted(rules, key=lambda r: r.priority):
+        comp = rule.compensate_mask(horizon)
+        if comp is not None:
+            if "休息" not in shifts:
+                shifts.append("休息")
+            codes[comp] = shifts.index("休息")
+        if rule.shift not in shifts:
+            shifts.append(rule.shift)
+        codes[rule.day_mask(horizon)] = shifts.index(rule.shift)
+    return CompiledRotation(horizon.ordinals, codes, shifts)
+
+# The existing Step 1 rules, re-expressed declaratively
+
+# Directors: rest on weekends, work on weekdays including weekday holidays
+DIRECTOR_ROTATION = ["shift=休息 weekdays=六,日"]
+
+# 江东 weekends alternate by ISO week; the week before a duty weekend has Thu/Fri off
+def jiangdong_weekend_rotation(start_with_jiangdong):
+    parity = "odd" if start_with_jiangdong else "even"
+    return [f"shift=值班 weekdays=六,日 parity={parity} compensate=四,五@-1 priority=10"]
+
+# Weekend pairs take turns every third week, one partner on Saturday and the other on Sunday,
+# swapping days on each turn. As in WeekendRotationRule the first partner of a pair has Thu/Fri off
+# in the duty week and the second partner Tue/Wed
+WEEKEND_PAIRS = [
+    ("陈荣盛", "楼峰", 0),
+    ("袁雷武", "张捷", 1),
+    ("章杰", "王振滨", 2),
+]
+
+def weekend_pair_rotation(name, other):
+    for first, second, phase in WEEKEND_PAIRS:
+        if {first, second} == {name, other}:
+            break
+    else:
+        raise ValueError(f"no weekend pair for {name} and {other}")
+    sunday_first = name == first
+    sunday_phase = phase if sunday_first else phase + 3
+    saturday_phase = phase + 3 if sunday_first else phase
+    rest = "四,五" if sunday_first else "二,三"
+    return [
+        f"shift=值班 weekdays=日 period=6 phase={sunday_phase} compensate={rest} priority=10",
+        f"shift=值班 weekdays=六 period=6 phase={saturday_phase} compensate={rest} priority=10",
+    ]
+
+# Rotation rules for every employee whose coworkers rule is a Step 1 rule
+class RotationSet:
+    def __init__(self, rules_by_employee):
+        # Employees with the same rule text share one parsed rule list, and so one compiled result
+        parsed = {}
+        self.rules = {}
+        for emp, rules in rules_by_employee.items():
+            key = tuple(rules)
+            if key not in parsed:
+                parsed[key] = [RotationRule.parse(text) if isinstance(text, str) else text for text in rules]
+            self.rules[emp] = parsed[key]
+
+    @classmethod
+    def from_coworkers(cls, coworkers):
+        rules = {}
+        for employee, rule in coworkers.items():
+            if isinstance(rule, DirectorRule):
+                rules[employee] = DIRECTOR_ROTATION
+            elif isinstance(rule, JiangdongWeekendRule):
+                rules[employee] = jiangdong_weekend_rotation(rule.start_with_jiangdong)
+            elif isinstance(rule, WeekendRotationRule):
+                rules[employee] = weekend_pair_rotation(rule.pair_name, rule.other_in_pair)
+        return cls(rules)
+
+    def __contains__(self, employee):
+        return employee in self.rules
+
+    def compile(self, start, end):
+        horizon = Horizon(start, end)
+        compiled = {}
+        by_rules = {}
+        for emp, rules in self.rules.items():
+            if id(rules) not in by_rules:
+                by_rules[id(rules)] = compile_rules(rules, horizon)
+            compiled[emp] = by_rules[id(rules)]
+        return compiled
+
+    # Step 1 of build_schedule: write every employee's compiled shifts for the month at once
+    def apply(self, schedule, rest_days, dates, leave_bits):
+        for employee, compiled in self.compile(dates[0], dates[-1]).items():
+            if (dates[0], employee) not in schedule:
+                continue
+            for current_date, shift in compiled.items():
+                if on_leave(leave_bits, employee, current_date.day):
+                    continue
+                schedule[(current_date, employee)] = shift
+                if shift == "休息":
+                    rest_days[employee].add(current_date)
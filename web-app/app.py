@@ -1,27 +1,107 @@
-from flask import Flask, render_template, request, send_file
+from flask import Flask, render_template, request, send_file, Response, abort, jsonify
 import io
-from datetime import datetime
+import os
+import multiprocessing
+import json
+from datetime import datetime, date
 import calendar
-from common import generate_schedule, coworkers, MONTH_NAMES
+from common import coworkers, FairnessLedger, LeaveCalendar, load_leave_file, LEAVE_TYPES, MONTH_NAMES, WEEKDAYS, GREEN_FILL, BLUE_FILL, YELLOW_FILL
+from schedule_store import ScheduleStore, schedule_payload
+from rotation import RotationSet
+from ical import IcalCache, iter_months, feed_etag, feed_last_modified
+from warmup import ScheduleWarmer
+from swaps import SwapService, SwapError, SwapLog
+from duty_index import DutyIndex, DUTY_SHIFTS
+from archive import iter_archive, parse_month, month_span, render_pool, ARCHIVE_FORMATS
 
 app = Flask(__name__)
 
+# Absences are read from this file at startup and written back when entered through /leave
+LEAVE_FILE = os.environ.get('SCHEDULE_LEAVE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leave.csv'))
+leave_calendar = load_leave_file(LEAVE_FILE) if os.path.exists(LEAVE_FILE) else LeaveCalendar()
+
+# Duty counts per person, carried from month to month so duties even out over the year
+FAIRNESS_DIR = os.environ.get('SCHEDULE_FAIRNESS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fairness'))
+
+# Applied swaps, re-applied whenever their month is built again (after a restart or new leave)
+SWAP_FILE = os.environ.get('SCHEDULE_SWAP_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'swaps.json'))
+swap_log = SwapLog(SWAP_FILE)
+
+# Generated months are kept so the xlsx download and the calendar feeds agree
+schedule_store = ScheduleStore(coworkers, leave=leave_calendar, rotations=RotationSet.from_coworkers(coworkers),
+                               ledger=FairnessLedger(FAIRNESS_DIR), swap_log=swap_log)
+ical_cache = IcalCache()
+swap_service = SwapService(schedule_store)
+
+# Who is on duty, rebuilt for a month every time the store replaces it
+duty_index = DutyIndex()
+schedule_store.subscribe(duty_index.refresh)
+
+# Pre-builds the current and next month so the end-of-month download rush hits the cache
+schedule_warmer = ScheduleWarmer(schedule_store)
+# Under the debug reloader the parent process only watches files, so it does not warm, and neither do
+# export workers, which import this module again when the app is started as a script;
+# SCHEDULE_WARMUP=0 turns warming off entirely
+if (os.environ.get('SCHEDULE_WARMUP', '1') != '0' and multiprocessing.parent_process() is None
+        and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')):
+    schedule_warmer.start()
+
+# Longest range a calendar feed may cover
+MAX_ICAL_MONTHS = 24
+
+# Longest range one archive export may cover
+MAX_EXPORT_MONTHS = 600
+
+# Serializes archive months for every export; workers start on first use
+export_pool = render_pool(min(4, os.cpu_count() or 1))
+
+# Months searched, starting with the date's own, for someone's next duty
+NEXT_DUTY_MONTHS = 3
+
 @app.route('/')
 def index():
     current_year = datetime.now().year
     current_month = datetime.now().month
     return render_template('index.html', current_year=current_year, current_month=current_month, month_name=MONTH_NAMES)
 
+# openpyxl stores colors as ARGB; the browser only needs the RGB part
+def fill_hex(fill):
+    return "#" + fill.start_color.rgb[-6:]
+
+@app.route('/preview')
+def preview():
+    current_year = datetime.now().year
+    current_month = datetime.now().month
+    return render_template(
+        'preview.html',
+        current_year=current_year,
+        current_month=current_month,
+        month_name=MONTH_NAMES,
+        weekdays=WEEKDAYS,
+        rest_color=fill_hex(GREEN_FILL),
+        weekday_color=fill_hex(BLUE_FILL),
+        weekend_color=fill_hex(YELLOW_FILL),
+    )
+
+@app.route('/schedule/<int:year>/<int:month>.json')
+def schedule_json(year, month):
+    if not 1 <= month <= 12:
+        abort(404)
+    entry = schedule_store.get(year, month)
+    body = json.dumps(schedule_payload(entry), ensure_ascii=False, separators=(',', ':'))
+    response = Response(body, mimetype='application/json')
+    response.set_etag(entry.version)
+    response.last_modified = entry.generated_at
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/generate', methods=['POST'])
 def generate():
     year = int(request.form['year'])
     month = int(request.form['month'])
-    wb = generate_schedule(year, month, coworkers)
-    
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
+    entry = schedule_store.get(year, month)
+    output = io.BytesIO(entry.xlsx_bytes())
+
     return send_file(
         output,
         as_attachment=True,
@@ -29,6 +109,169 @@ def generate():
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
 
+@app.route('/ical/<employee>')
+def ical_feed(employee):
+    if employee not in coworkers:
+        abort(404)
+    now = datetime.now()
+    year = request.args.get('year', now.year, type=int)
+    month = request.args.get('month', now.month, type=int)
+    months = request.args.get('months', 3, type=int)
+    if not 1 <= month <= 12 or not 1 <= months <= MAX_ICAL_MONTHS:
+        abort(400)
+
+    entries = [schedule_store.get(y, m) for y, m in iter_months(year, month, months)]
+    response = Response(ical_cache.iter_feed(employee, entries), mimetype='text/calendar')
+    response.charset = 'utf-8'
+    response.set_etag(feed_etag(employee, entries))
+    response.last_modified = feed_last_modified(entries)
+    response.cache_control.no_cache = True
+    # Turns the response into a body-less 304 when the client's copy is current
+    return response.make_conditional(request)
+
+# Month source for one export. Stored months go in as stored (including applied swaps). The others are
+# built in order in a throwaway store, from copies of the fairness ledger and swap log, and dropped
+# once written, so an export neither grows the live store nor changes the live fairness counts
+def export_months():
+    scratch = ScheduleStore(coworkers, leave=leave_calendar, rotations=schedule_store.rotations,
+                            ledger=schedule_store.ledger.snapshot(), swap_log=swap_log.snapshot(),
+                            lock=schedule_store.lock)
+
+    def month_entry(year, month):
+        entry = schedule_store.entries.get((year, month))
+        if entry is None:
+            entry = scratch.get(year, month)
+            scratch.discard(year, month)
+        return entry
+    return month_entry
+
+@app.route('/export')
+def export_archive():
+    fmt = request.args.get('format', 'xlsx')
+    try:
+        start = parse_month(request.args.get('start', ''))
+        end = parse_month(request.args.get('end', ''))
+    except ValueError:
+        abort(400)
+    if fmt not in ARCHIVE_FORMATS or end < start:
+        abort(400)
+    if sum(1 for _ in month_span(start, end)) > MAX_EXPORT_MONTHS:
+        abort(400)
+
+    response = Response(iter_archive(start, end, export_months(), export_pool, fmt), mimetype='application/zip')
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="schedules_{start[0]}_{start[1]:02d}-{end[0]}_{end[1]:02d}.zip"'
+    )
+    return response
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+# Read a swap (employee_a, employee_b, date_a and optional date_b) from a JSON body
+def swap_arguments():
+    data = request.get_json(silent=True) or {}
+    if not data.get('employee_a') or not data.get('employee_b'):
+        abort(400)
+    date_b = parse_date(data['date_b']) if data.get('date_b') else None
+    return data['employee_a'], data['employee_b'], parse_date(data.get('date_a')), date_b
+
+@app.route('/swaps/partners')
+def swap_partners():
+    employee = request.args.get('employee', '')
+    on_date = parse_date(request.args.get('date'))
+    try:
+        shift, partners = swap_service.partners(employee, on_date)
+    except SwapError as e:
+        return jsonify(error=e.violations), 404
+    return jsonify(employee=employee, date=on_date.isoformat(), shift=shift, partners=partners)
+
+@app.route('/swaps/validate', methods=['POST'])
+def swap_validate():
+    try:
+        violations = swap_service.validate(*swap_arguments())
+    except SwapError as e:
+        violations = e.violations
+    return jsonify(ok=not violations, violations=violations)
+
+@app.route('/swaps', methods=['POST'])
+def swap_apply():
+    try:
+        entry = swap_service.apply(*swap_arguments())
+    except SwapError as e:
+        return jsonify(ok=False, violations=e.violations), 409
+    return jsonify(ok=True, version=entry.version)
+
+@app.route('/on-duty')
+def on_duty():
+    shifts = request.args.getlist('shift') or DUTY_SHIFTS
+    if any(shift not in DUTY_SHIFTS for shift in shifts):
+        abort(400)
+    on_date = parse_date(request.args['date']) if request.args.get('date') else date.today()
+    # Indexing happens when a month is stored, so make sure the month has been generated
+    if not duty_index.has_month(on_date.year, on_date.month):
+        schedule_store.get(on_date.year, on_date.month)
+
+    employee = request.args.get('employee')
+    if employee is None:
+        return jsonify(date=on_date.isoformat(),
+                       on_duty={shift: list(duty_index.on_duty(on_date, shift)) for shift in shifts})
+    if employee not in coworkers:
+        abort(404)
+    # Next duty on or after the date, per shift type
+    next_duty = {}
+    for shift in shifts:
+        next_date = find_next_duty(employee, shift, on_date)
+        next_duty[shift] = next_date.isoformat() if next_date else None
+    return jsonify(employee=employee, date=on_date.isoformat(), next_duty=next_duty)
+
+# Only trust an answer from months indexed without gaps after the date; index the next month when
+# the search runs past the last one, up to NEXT_DUTY_MONTHS
+def find_next_duty(employee, shift, on_date):
+    for year, month in iter_months(on_date.year, on_date.month, NEXT_DUTY_MONTHS):
+        if not duty_index.has_month(year, month):
+            schedule_store.get(year, month)
+        next_date = duty_index.next_duty(employee, shift, on_date)
+        if next_date is not None and (next_date.year, next_date.month) <= (year, month):
+            return next_date
+    return None
+
+@app.route('/leave')
+def leave_list():
+    return jsonify(leave=[
+        {'employee': employee, 'start': start.isoformat(), 'end': end.isoformat(), 'type': kind}
+        for employee, start, end, kind in leave_calendar.entries
+    ])
+
+@app.route('/leave', methods=['POST'])
+def leave_add():
+    data = request.get_json(silent=True) or request.form
+    employee = data.get('employee', '')
+    if employee not in coworkers:
+        return jsonify(error=f'未知员工 {employee}'), 400
+    start = parse_date(data.get('start'))
+    end = parse_date(data.get('end')) if data.get('end') else start
+    try:
+        leave_calendar.add(employee, start, end, data.get('type') or LEAVE_TYPES[0])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    leave_calendar.save(LEAVE_FILE)
+    # Months already generated or holding swaps are rebuilt now with the new absence. Their swaps are
+    # re-applied; the ones that no longer fit (e.g. a swapped day is now leave) are reported back
+    dropped = []
+    for year, month in LeaveCalendar.months_of(start, end):
+        before = swap_log.swaps(year, month)
+        if (year, month) in schedule_store.entries or before:
+            schedule_store.regenerate(year, month)
+            after = swap_log.swaps(year, month)
+            dropped.extend(swap for swap in before if swap not in after)
+    return jsonify(ok=True, dropped_swaps=[
+        [{'date': day, 'employee': emp, 'shift': shift} for day, emp, _, shift in swap['cells']]
+        for swap in dropped
+    ]), 201
+
 if __name__ == '__main__':
     # app.run(debug=True)
-    app.run(host='0.0.0.0',port=5000,debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0',port=5000,debug=True)
@@ -0,0 +1,163 @@
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import sys
+import zipfile
+import calendar
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from common import schedule_to_workbook, coworkers, load_leave_file, FairnessLedger, WEEKDAYS
+from schedule_store import ScheduleStore
+from rotation import RotationSet
+
+ARCHIVE_FORMATS = ("xlsx", "csv")
+
+# Months generated ahead of the one being written; bounds memory regardless of the range
+DEFAULT_IN_FLIGHT = 4
+
+def parse_month(text):
+    try:
+        year, month = (int(part) for part in text.split("-"))
+    except ValueError:
+        raise ValueError(f"expected YYYY-MM, got {text!r}")
+    if not 1 <= month <= 12:
+        raise ValueError(f"expected YYYY-MM, got {text!r}")
+    return year, month
+
+# (year, month) pairs from start to end inclusive
+def month_span(start, end):
+    year, month = start
+    while (year, month) <= end:
+        yield year, month
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+def archive_name(year, month, fmt):
+    return f"schedule_{year}_{month:02d}.{fmt}"
+
+# Same layout as the workbook: day and weekday header rows, then one row per employee
+def schedule_to_csv(year, month, schedule, employees):
+    num_days = calendar.monthrange(year, month)[1]
+    dates = [date(year, month, day) for day in range(1, num_days + 1)]
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["天"] + [d.day for d in dates])
+    writer.writerow(["星期"] + [WEEKDAYS[d.weekday()] for d in dates])
+    for employee in employees:
+        writer.writerow([employee] + [schedule[(d, employee)] for d in dates])
+    # Excel only detects UTF-8 CSV files with a BOM
+    return output.getvalue().encode("utf-8-sig")
+
+def render_schedule(year, month, schedule, employees, fmt):
+    if fmt == "csv":
+        return schedule_to_csv(year, month, schedule, employees)
+    output = io.BytesIO()
+    schedule_to_workbook(year, month, schedule, employees).save(output)
+    return output.getvalue()
+
+# Worker processes only serialize finished months. They are spawned rather than forked: forking the
+# multithreaded web server could hand the child a lock (e.g. ScheduleStore.lock) held by another thread
+def render_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+# File-like sink that hands out whatever zipfile has written so far
+class _ZipSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+# Stream a zip of per-month files; months are serialized in the process pool while earlier ones are sent.
+# source(year, month) returns the month's ScheduleEntry (e.g. ScheduleStore.get). It is called here, in
+# month order, so months built on the way go through the fairness ledger one after another
+def iter_archive(start, end, source, pool, fmt="xlsx", in_flight=DEFAULT_IN_FLIGHT):
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"unknown archive format: {fmt}")
+    months = month_span(start, end)
+    sink = _ZipSink()
+    pending = deque()
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            def submit_next():
+                item = next(months, None)
+                if item is None:
+                    return
+                year, month = item
+                entry = source(year, month)
+                data = entry.cached_xlsx() if fmt == "xlsx" else None
+                if data is None:
+                    data = pool.submit(render_schedule, year, month, entry.schedule, entry.employees, fmt)
+                pending.append((year, month, data))
+
+            for _ in range(max(1, in_flight)):
+                submit_next()
+            while pending:
+                year, month, result = pending.popleft()
+                submit_next()
+                data = result if isinstance(result, bytes) else result.result()
+                zf.writestr(archive_name(year, month, fmt), data)
+                yield sink.drain()
+        # Central directory written on close
+        yield sink.drain()
+    finally:
+        # Also runs when the client disconnects and the generator is closed early; the pool may be shared
+        for _, _, result in pending:
+            if not isinstance(result, bytes):
+                result.cancel()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a range of monthly schedules as a zip archive")
+    parser.add_argument("start", help="first month, YYYY-MM")
+    parser.add_argument("end", help="last month, YYYY-MM")
+    parser.add_argument("-o", "--output", help="zip file to write (default: stdout)")
+    parser.add_argument("--format", choices=ARCHIVE_FORMATS, default="xlsx")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--in-flight", type=int, default=DEFAULT_IN_FLIGHT)
+    parser.add_argument("--leave", help="leave file (CSV or JSON) applied to every month")
+    parser.add_argument("--fairness", help="fairness ledger directory to build against and update "
+                                           "(default: start from empty counts)")
+    args = parser.parse_args(argv)
+    try:
+        start, end = parse_month(args.start), parse_month(args.end)
+    except ValueError as e:
+        parser.error(str(e))
+    if end < start:
+        parser.error("end month is before start month")
+
+    leave = load_leave_file(args.leave) if args.leave else None
+    store = ScheduleStore(coworkers, leave=leave, rotations=RotationSet.from_coworkers(coworkers),
+                          ledger=FairnessLedger(args.fairness))
+
+    # Each month is only needed until it is written, so it does not stay in the store
+    def built_month(year, month):
+        entry = store.get(year, month)
+        store.discard(year, month)
+        return entry
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    pool = render_pool(args.workers)
+    try:
+        for chunk in iter_archive(start, end, built_month, pool, args.format, args.in_flight):
+            out.write(chunk)
+    finally:
+        pool.shutdown()
+        if args.output:
+            out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+from datetime import date, timedelta
+from itertools import cycle
+from common import DirectorRule, JiangdongWeekendRule, WeekendRotationRule
+from rotation import (RotationSet, DIRECTOR_ROTATION, jiangdong_weekend_rotation, weekend_pair_rotation,
+                      WEEKEND_PAIRS)
+
+# Step 1 rule objects for a roster of the given size, cycling through the three rule kinds
+def per_cell_roster(size):
+    roster = {}
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            roster[f"director{i}"] = DirectorRule()
+        elif kind == 1:
+            roster[f"jiangdong{i}"] = JiangdongWeekendRule(start_with_jiangdong=i % 2 == 1)
+        else:
+            first, second, phase = WEEKEND_PAIRS[i % len(WEEKEND_PAIRS)]
+            pattern = [False] * len(WEEKEND_PAIRS)
+            pattern[phase] = True
+            name, other = (first, second) if kind == 2 else (second, first)
+            roster[f"pair{i}"] = WeekendRotationRule(name, other, cycle(pattern))
+    return roster
+
+# The same roster expressed as rotation rules
+def rotation_roster(roster):
+    rules = {}
+    for employee, rule in roster.items():
+        if isinstance(rule, DirectorRule):
+            rules[employee] = DIRECTOR_ROTATION
+        elif isinstance(rule, JiangdongWeekendRule):
+            rules[employee] = jiangdong_weekend_rotation(rule.start_with_jiangdong)
+        else:
+            rules[employee] = weekend_pair_rotation(rule.pair_name, rule.other_in_pair)
+    return RotationSet(rules)
+
+# Current path: one assign_shift call per employee per day
+def run_per_cell(roster, dates):
+    schedule = {}
+    for current_date in dates:
+        for employee, rule in roster.items():
+            schedule[(current_date, employee)] = rule.assign_shift(current_date, schedule, set())
+    return schedule
+
+# Declarative path: one vectorized compile per employee for the whole horizon
+def run_masks(rotations, dates):
+    return rotations.compile(dates[0], dates[-1])
+
+# Declarative path including writing the results into a schedule dictionary, as build_schedule does
+def run_masks_applied(rotations, dates):
+    schedule = {}
+    for employee, compiled in rotations.compile(dates[0], dates[-1]).items():
+        for current_date, shift in compiled.items():
+            schedule[(current_date, employee)] = shift
+    return schedule
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-cell rule evaluation with compiled rotation masks")
+    parser.add_argument("--employees", type=int, nargs="+", default=[15, 100, 500])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    start = date(date.today().year, 1, 1)
+    dates = [start + timedelta(days=i) for i in range(args.days)]
+    # Speedup compares like with like: both paths end with every cell written into a schedule dictionary.
+    # The masks are compiled once per distinct rule list, which the "rule lists" column shows
+    print(f"{'employees':>9} {'rule lists':>10} {'cells':>9} {'per-cell ms':>12} {'masks ms':>10} "
+          f"{'+apply ms':>10} {'speedup':>8}")
+    for size in args.employees:
+        roster = per_cell_roster(size)
+        rotations = rotation_roster(roster)
+        rule_lists = len({id(rules) for rules in rotations.rules.values()})
+        per_cell = best_of(args.repeat, run_per_cell, roster, dates)
+        masks = best_of(args.repeat, run_masks, rotations, dates)
+        applied = best_of(args.repeat, run_masks_applied, rotations, dates)
+        print(f"{size:>9} {rule_lists:>10} {size * len(dates):>9} {per_cell * 1000:>12.1f} {masks * 1000:>10.1f} "
+              f"{applied * 1000:>10.1f} {per_cell / applied:>7.1f}x")
+    print("speedup = per-cell / +apply; masks ms is the compile alone, shared by employees with the same rule list")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+# Shifts the operations desk asks about
+DUTY_SHIFTS = ["值班", "江东班", "开发班"]
+
+# One generated month, inverted: (day, shift) -> employees and (employee, shift) -> sorted days
+class MonthDutyIndex:
+    def __init__(self, entry):
+        self.year = entry.year
+        self.month = entry.month
+        self.version = entry.version
+        by_day = defaultdict(list)
+        by_employee = defaultdict(list)
+        # Walk the cells in date order so every per-employee list comes out sorted
+        for (current_date, employee), shift in sorted(entry.schedule.items()):
+            if shift in DUTY_SHIFTS:
+                by_day[(current_date, shift)].append(employee)
+                by_employee[(employee, shift)].append(current_date)
+        self.by_day = {key: tuple(employees) for key, employees in by_day.items()}
+        self.by_employee = dict(by_employee)
+
+# Immutable snapshot over every indexed month; replaced as a whole, never modified
+class DutySnapshot:
+    def __init__(self, months):
+        self.months = months
+        self.by_day = {}
+        by_employee = defaultdict(list)
+        for key in sorted(months):
+            part = months[key]
+            self.by_day.update(part.by_day)
+            for employee_shift, days in part.by_employee.items():
+                by_employee[employee_shift].extend(days)
+        self.by_employee = dict(by_employee)
+
+    def on_duty(self, on_date, shift):
+        return self.by_day.get((on_date, shift), ())
+
+    def next_duty(self, employee, shift, after):
+        days = self.by_employee.get((employee, shift), [])
+        i = bisect_left(days, after)
+        return days[i] if i < len(days) else None
+
+# Keeps the current snapshot and swaps in a new one whenever a month is (re)generated
+class DutyIndex:
+    def __init__(self):
+        self.snapshot = DutySnapshot({})
+        self.lock = threading.Lock()
+
+    def has_month(self, year, month):
+        return (year, month) in self.snapshot.months
+
+    # ScheduleStore callback: entry is the new month, or None when the month was discarded
+    def refresh(self, year, month, entry):
+        with self.lock:
+            months = dict(self.snapshot.months)
+            if entry is None:
+                months.pop((year, month), None)
+            else:
+                months[(year, month)] = MonthDutyIndex(entry)
+            # Readers holding the previous snapshot keep a consistent view
+            self.snapshot = DutySnapshot(months)
+
+    def on_duty(self, on_date, shift):
+        return self.snapshot.on_duty(on_date, shift)
+
+    def next_duty(self, employee, shift, after):
+        return self.snapshot.next_duty(employee, shift, after)
@@ -0,0 +1,103 @@
+import hashlib
+import threading
+import calendar
+from datetime import date, timedelta
+from common import LEAVE_TYPES, OFF_SHIFTS
+
+# Shifts that get a calendar event; ordinary "工作" days are left out to keep the calendar readable
+ICAL_SHIFTS = ["休息", "值班", "江东班", "开发班", "内勤", "外勤"] + LEAVE_TYPES
+
+CALENDAR_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "VERSION:2.0\r\n"
+    "PRODID:-//py-work-schedule-cn//排班表//ZH\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+    "METHOD:PUBLISH\r\n"
+)
+CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+# Iterate (year, month) pairs starting at the given month
+def iter_months(year, month, count):
+    for _ in range(count):
+        yield year, month
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+# Content lines are limited to 75 octets; continuation lines start with a space
+def _fold(line):
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return data + b"\r\n"
+    parts = []
+    limit = 75
+    while data:
+        cut = min(limit, len(data))
+        # Never split inside a multi-byte UTF-8 character
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+        limit = 74
+    return b"\r\n ".join(parts) + b"\r\n"
+
+# Serialize one employee's shifts for one generated month as VEVENT blocks
+def serialize_month(entry, employee):
+    stamp = entry.generated_at.strftime("%Y%m%dT%H%M%SZ")
+    uid_suffix = hashlib.sha1(employee.encode("utf-8")).hexdigest()[:12]
+    chunks = []
+    num_days = calendar.monthrange(entry.year, entry.month)[1]
+    for day in range(1, num_days + 1):
+        current_date = date(entry.year, entry.month, day)
+        shift = entry.schedule.get((current_date, employee))
+        if shift not in ICAL_SHIFTS:
+            continue
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:{current_date:%Y%m%d}-{uid_suffix}@py-work-schedule-cn",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{current_date:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{current_date + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_escape(shift)}",
+            f"DESCRIPTION:{_escape(employee)} {_escape(shift)}",
+            "TRANSP:TRANSPARENT" if shift in OFF_SHIFTS else "TRANSP:OPAQUE",
+            "END:VEVENT",
+        ]
+        chunks.extend(_fold(line) for line in lines)
+    return b"".join(chunks)
+
+# The ETag only depends on which generated months the feed covers, so a 304 needs no serialization
+def feed_etag(employee, entries):
+    digest = hashlib.sha1(employee.encode("utf-8"))
+    for entry in entries:
+        digest.update(entry.version.encode("ascii"))
+    return digest.hexdigest()
+
+def feed_last_modified(entries):
+    return max(entry.generated_at for entry in entries)
+
+# Serialized feed fragments per employee per month, replaced when the month is regenerated
+class IcalCache:
+    def __init__(self):
+        self.fragments = {}
+        self.lock = threading.Lock()
+
+    def month_fragment(self, entry, employee):
+        key = (employee, entry.year, entry.month)
+        cached = self.fragments.get(key)
+        if cached is not None and cached[0] == entry.version:
+            return cached[1]
+        fragment = serialize_month(entry, employee)
+        with self.lock:
+            self.fragments[key] = (entry.version, fragment)
+        return fragment
+
+    # Stream the feed month by month instead of building it in memory
+    def iter_feed(self, employee, entries):
+        yield CALENDAR_HEADER.encode("utf-8") + _fold(f"X-WR-CALNAME:{_escape(employee)} 排班")
+        for entry in entries:
+            yield self.month_fragment(entry, employee)
+        yield CALENDAR_FOOTER.encode("utf-8")
@@ -0,0 +1,280 @@
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from common import coworkers
+
+# Default request mix: weight per request kind
+DEFAULT_MIX = "generate=6,preview=2,ical=1,index=1"
+
+# Resident set size of a process in MB; falls back to the peak RSS of this process
+def rss_mb(pid=None):
+    path = f"/proc/{pid or 'self'}/status"
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is not None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# The months a run spreads its requests over, starting from the current month
+def month_pool(spread):
+    now = datetime.now()
+    year, month = now.year, now.month
+    months = []
+    for _ in range(spread):
+        months.append((year, month))
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+# Each request kind returns (method, path, form data)
+def request_generate(rng, months):
+    year, month = rng.choice(months)
+    return "POST", "/generate", {"year": str(year), "month": str(month)}
+
+def request_preview(rng, months):
+    year, month = rng.choice(months)
+    return "GET", f"/schedule/{year}/{month}.json", None
+
+def request_ical(rng, months):
+    year, month = rng.choice(months)
+    employee = quote(rng.choice(list(coworkers.keys())))
+    return "GET", f"/ical/{employee}?year={year}&month={month}", None
+
+def request_index(rng, months):
+    return "GET", "/", None
+
+REQUEST_KINDS = {
+    "generate": request_generate,
+    "preview": request_preview,
+    "ical": request_ical,
+    "index": request_index,
+}
+
+# Sends requests through Flask's test client, in this process
+class TestClientTarget:
+    def __init__(self):
+        # The app reads its settings on import: keep the run's state files out of the real ones and
+        # leave out the background warmer, which would skew latency and RSS
+        self.state_dir = tempfile.TemporaryDirectory(prefix="loadtest-")
+        os.environ["SCHEDULE_WARMUP"] = "0"
+        os.environ["SCHEDULE_LEAVE_FILE"] = os.path.join(self.state_dir.name, "leave.csv")
+        os.environ["SCHEDULE_FAIRNESS_DIR"] = os.path.join(self.state_dir.name, "fairness")
+        os.environ["SCHEDULE_SWAP_FILE"] = os.path.join(self.state_dir.name, "swaps.json")
+        from app import app
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, method, path, data):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, data=data)
+        # Drain streamed bodies so the full response cost is measured
+        response.get_data()
+        return response.status_code
+
+# Sends requests to a running server over HTTP
+class HttpTarget:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def send(self, method, path, data):
+        body = urllib.parse.urlencode(data).encode("ascii") if data else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+class LoadRun:
+    def __init__(self, target, mix, concurrency, duration, warmup, spread, seed, rss_pid, sample_interval):
+        self.target = target
+        self.kinds = list(mix.keys())
+        self.weights = list(mix.values())
+        self.concurrency = concurrency
+        self.duration = duration
+        self.warmup = warmup
+        self.months = month_pool(spread)
+        self.seed = seed
+        self.rss_pid = rss_pid
+        self.sample_interval = sample_interval
+        self.latencies = {kind: [] for kind in self.kinds}
+        self.errors = {kind: 0 for kind in self.kinds}
+        self.rss_samples = []
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+
+    def worker(self, index):
+        rng = random.Random(self.seed + index)
+        measure_from = self.started + self.warmup
+        while time.monotonic() < self.deadline:
+            kind = rng.choices(self.kinds, self.weights)[0]
+            method, path, data = REQUEST_KINDS[kind](rng, self.months)
+            begin = time.monotonic()
+            try:
+                status = self.target.send(method, path, data)
+                failed = status >= 400
+            except Exception:
+                failed = True
+            elapsed = time.monotonic() - begin
+            if begin < measure_from:
+                continue
+            with self.lock:
+                self.latencies[kind].append(elapsed)
+                if failed:
+                    self.errors[kind] += 1
+
+    def sampler(self):
+        while not self.stop.wait(self.sample_interval):
+            self.rss_samples.append((time.monotonic() - self.started, rss_mb(self.rss_pid)))
+
+    def run(self):
+        self.started = time.monotonic()
+        self.deadline = self.started + self.warmup + self.duration
+        sampler = threading.Thread(target=self.sampler, daemon=True)
+        sampler.start()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            # Take the baseline RSS once the warmup has populated the caches
+            pool_futures = [pool.submit(self.worker, i) for i in range(self.concurrency)]
+            time.sleep(self.warmup)
+            self.rss_start = rss_mb(self.rss_pid)
+            for future in pool_futures:
+                future.result()
+        self.rss_end = rss_mb(self.rss_pid)
+        self.stop.set()
+        sampler.join()
+        return self.report()
+
+    def report(self):
+        all_latencies = sorted(l for values in self.latencies.values() for l in values)
+        total = len(all_latencies)
+        errors = sum(self.errors.values())
+        rss_values = [rss for _, rss in self.rss_samples if rss is not None]
+        result = {
+            "requests": total,
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "throughput": total / self.duration,
+            "p50_ms": percentile(all_latencies, 50) * 1000,
+            "p95_ms": percentile(all_latencies, 95) * 1000,
+            "p99_ms": percentile(all_latencies, 99) * 1000,
+            "rss_start_mb": self.rss_start,
+            "rss_end_mb": self.rss_end,
+            "rss_peak_mb": max(rss_values) if rss_values else self.rss_end,
+            "by_kind": {},
+        }
+        if self.rss_start is not None and self.rss_end is not None:
+            result["rss_growth_mb"] = self.rss_end - self.rss_start
+        else:
+            result["rss_growth_mb"] = None
+        for kind in self.kinds:
+            values = sorted(self.latencies[kind])
+            result["by_kind"][kind] = {
+                "requests": len(values),
+                "errors": self.errors[kind],
+                "p50_ms": percentile(values, 50) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+        return result
+
+def print_report(result):
+    print(f"requests:    {result['requests']} ({result['errors']} errors, {result['error_rate']:.2%})")
+    print(f"throughput:  {result['throughput']:.1f} req/s")
+    print(f"latency:     p50 {result['p50_ms']:.1f} ms  p95 {result['p95_ms']:.1f} ms  p99 {result['p99_ms']:.1f} ms")
+    if result["rss_growth_mb"] is not None:
+        print(f"rss:         {result['rss_start_mb']:.1f} MB -> {result['rss_end_mb']:.1f} MB "
+              f"(growth {result['rss_growth_mb']:+.1f} MB, peak {result['rss_peak_mb']:.1f} MB)")
+    else:
+        print("rss:         unavailable (pass --pid of the server to sample it)")
+    for kind, stats in result["by_kind"].items():
+        print(f"  {kind:<10} {stats['requests']:>7} req  {stats['errors']:>4} err  "
+              f"p50 {stats['p50_ms']:.1f} ms  p99 {stats['p99_ms']:.1f} ms")
+
+# Compare a run with the thresholds; returns the list of violations
+def check_thresholds(result, args):
+    failures = []
+    if args.max_p99_ms is not None and result["p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 {result['p99_ms']:.1f} ms > {args.max_p99_ms} ms")
+    if args.min_rps is not None and result["throughput"] < args.min_rps:
+        failures.append(f"throughput {result['throughput']:.1f} req/s < {args.min_rps} req/s")
+    if args.max_error_rate is not None and result["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {result['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    growth = result["rss_growth_mb"]
+    if args.max_rss_growth_mb is not None and growth is not None and growth > args.max_rss_growth_mb:
+        failures.append(f"rss growth {growth:.1f} MB > {args.max_rss_growth_mb} MB")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and soak test for the schedule web app")
+    parser.add_argument("--url", help="base URL of a running server; default drives the app in-process via the test client")
+    parser.add_argument("--pid", type=int, help="server process id to sample RSS from when using --url")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds excluded from the measurements")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"request weights, e.g. {DEFAULT_MIX}")
+    parser.add_argument("--months", type=int, default=3, help="number of months the requests are spread over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between RSS samples")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--min-rps", type=float)
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--max-rss-growth-mb", type=float)
+    args = parser.parse_args(argv)
+
+    if args.url:
+        target = HttpTarget(args.url)
+        rss_pid = args.pid
+    else:
+        target = TestClientTarget()
+        rss_pid = None
+
+    run = LoadRun(target, args.mix, args.concurrency, args.duration, args.warmup,
+                  args.months, args.seed, rss_pid, args.sample_interval)
+    result = run.run()
+    print_report(result)
+
+    failures = check_thresholds(result, args)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("PASS" if not failures else "FAILED")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
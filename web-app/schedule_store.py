@@ -0,0 +1,158 @@
+import io
+import threading
+import calendar
+from concurrent.futures import Future
+from itertools import count
+from datetime import date, datetime, timezone
+from common import build_schedule, schedule_to_workbook, duty_pools, default_ledger
+
+# Distinguishes regenerations that happen within the same second
+_generation_counter = count(1)
+
+# A generated month: the shift dictionary plus the time it was produced
+class ScheduleEntry:
+    def __init__(self, year, month, schedule, employees):
+        self.year = year
+        self.month = month
+        self.schedule = schedule
+        self.employees = employees
+        # HTTP dates have one-second resolution, so drop the microseconds
+        self.generated_at = datetime.now(timezone.utc).replace(microsecond=0)
+        self.version = f"{year}-{month:02d}-{self.generated_at.timestamp():.0f}-{next(_generation_counter)}"
+        self._xlsx = None
+        self._xlsx_lock = threading.Lock()
+
+    # The saved workbook if it has been serialized already, else None
+    def cached_xlsx(self):
+        return self._xlsx
+
+    # The saved workbook, serialized once per entry
+    def xlsx_bytes(self):
+        if self._xlsx is None:
+            with self._xlsx_lock:
+                if self._xlsx is None:
+                    wb = schedule_to_workbook(self.year, self.month, self.schedule, self.employees)
+                    output = io.BytesIO()
+                    wb.save(output)
+                    self._xlsx = output.getvalue()
+        return self._xlsx
+
+# Keeps one generated schedule per month so every view of a month agrees
+class ScheduleStore:
+    def __init__(self, coworkers, leave=None, rotations=None, ledger=None, swap_log=None, lock=None):
+        self.coworkers = coworkers
+        self.leave = leave
+        self.rotations = rotations
+        # build_schedule falls back to the same default ledger
+        self.ledger = ledger or default_ledger
+        # Cell changes made through update() are recorded here and re-applied after every build
+        self.swap_log = swap_log
+        self.entries = {}
+        # Called as listener(year, month, entry) whenever a month is replaced (entry None when discarded)
+        self.listeners = []
+        # Months being built right now; later callers wait on the same future
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        # The rules keep state between calls, so only one month is built at a time; stores sharing
+        # the same coworkers must share this lock
+        self.lock = lock or threading.Lock()
+
+    def get(self, year, month):
+        key = (year, month)
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+        with self.in_flight_lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            with self.lock:
+                entry = self._build(year, month)
+            future.set_result(entry)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+        return entry
+
+    def regenerate(self, year, month):
+        with self.lock:
+            return self._build(year, month)
+
+    # Replace some cells of a stored month; readers keep the old entry until the new one is swapped in.
+    # Returns None when expected is given and the month has changed since it was read
+    def update(self, year, month, changes, expected=None):
+        self.get(year, month)
+        with self.lock:
+            current = self.entries[(year, month)]
+            if expected is not None and current is not expected:
+                return None
+            if self.swap_log is not None:
+                self.swap_log.add(year, month, current.schedule, changes)
+            schedule = dict(current.schedule)
+            schedule.update(changes)
+            # Later months are balanced against who really holds the duties now
+            self.ledger.record_month(year, month, schedule, {pool.ledger_key for pool in duty_pools(self.coworkers)})
+            entry = ScheduleEntry(year, month, schedule, current.employees)
+            self._publish(year, month, entry)
+            return entry
+
+    # Forget a stored month so the next request builds it again (e.g. after leave changes)
+    def discard(self, year, month):
+        with self.lock:
+            if (year, month) in self.entries:
+                self._publish(year, month, None)
+
+    def _build(self, year, month):
+        schedule = build_schedule(year, month, self.coworkers, leave=self.leave, rotations=self.rotations,
+                                  ledger=self.ledger)
+        if self.swap_log is not None and self.swap_log.swaps(year, month):
+            self.swap_log.reapply(year, month, schedule)
+            self.ledger.record_month(year, month, schedule, {pool.ledger_key for pool in duty_pools(self.coworkers)})
+        entry = ScheduleEntry(year, month, schedule, list(self.coworkers.keys()))
+        self._publish(year, month, entry)
+        return entry
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _publish(self, year, month, entry):
+        if entry is None:
+            self.entries.pop((year, month), None)
+        else:
+            self.entries[(year, month)] = entry
+        for listener in self.listeners:
+            listener(year, month, entry)
+
+# Compact form of a month for the browser: a shift-code list plus an employee x day matrix of indexes
+def schedule_payload(entry):
+    num_days = calendar.monthrange(entry.year, entry.month)[1]
+    codes = []
+    code_index = {}
+    rows = []
+    for employee in entry.employees:
+        row = []
+        for day in range(1, num_days + 1):
+            shift = entry.schedule[(date(entry.year, entry.month, day), employee)]
+            if shift not in code_index:
+                code_index[shift] = len(codes)
+                codes.append(shift)
+            row.append(code_index[shift])
+        rows.append(row)
+    return {
+        "year": entry.year,
+        "month": entry.month,
+        "first_weekday": date(entry.year, entry.month, 1).weekday(),
+        "codes": codes,
+        "employees": entry.employees,
+        "rows": rows,
+    }
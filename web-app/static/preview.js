@@ -0,0 +1,106 @@
+// Months already fetched in this page, keyed by "year-month"; values are promises so
+// switching back and forth never issues a second request for the same month
+const monthCache = new Map();
+
+const yearInput = document.getElementById('year');
+const monthSelect = document.getElementById('month');
+const grid = document.getElementById('rosterGrid');
+const status = document.getElementById('status');
+
+function fetchMonth(year, month) {
+    const key = `${year}-${month}`;
+    if (!monthCache.has(key)) {
+        const request = fetch(`${SCHEDULE_URL_BASE}${year}/${month}.json`).then(response => {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        });
+        // Drop failed requests so the month can be retried
+        request.catch(() => monthCache.delete(key));
+        monthCache.set(key, request);
+    }
+    return monthCache.get(key);
+}
+
+function renderMonth(data) {
+    const numDays = data.rows.length ? data.rows[0].length : 0;
+    const fragment = document.createDocumentFragment();
+
+    // Row 1: day of month, colored like the Excel header
+    const dayRow = document.createElement('tr');
+    dayRow.appendChild(headerCell('天'));
+    // Row 2: weekday names
+    const weekdayRow = document.createElement('tr');
+    weekdayRow.appendChild(headerCell('星期'));
+    for (let day = 0; day < numDays; day++) {
+        const weekday = (data.first_weekday + day) % 7;
+        const cell = headerCell(day + 1);
+        cell.className = weekday >= 5 ? 'weekend' : 'weekday';
+        dayRow.appendChild(cell);
+        weekdayRow.appendChild(headerCell(WEEKDAYS[weekday]));
+    }
+    fragment.appendChild(dayRow);
+    fragment.appendChild(weekdayRow);
+
+    data.rows.forEach((row, index) => {
+        const tr = document.createElement('tr');
+        const name = document.createElement('th');
+        name.textContent = data.employees[index];
+        tr.appendChild(name);
+        for (const code of row) {
+            const td = document.createElement('td');
+            const shift = data.codes[code];
+            td.textContent = shift;
+            if (shift === '休息') {
+                td.className = 'rest';
+            }
+            tr.appendChild(td);
+        }
+        fragment.appendChild(tr);
+    });
+
+    grid.replaceChildren(fragment);
+}
+
+function headerCell(text) {
+    const th = document.createElement('th');
+    th.textContent = text;
+    return th;
+}
+
+function showSelectedMonth() {
+    const year = parseInt(yearInput.value, 10);
+    const month = parseInt(monthSelect.value, 10);
+    status.textContent = '正在加载排班表...';
+    fetchMonth(year, month)
+        .then(data => {
+            renderMonth(data);
+            status.textContent = '';
+        })
+        .catch(() => {
+            status.textContent = '加载排班表失败';
+        });
+}
+
+function shiftMonth(delta) {
+    let year = parseInt(yearInput.value, 10);
+    let month = parseInt(monthSelect.value, 10) + delta;
+    if (month < 1) {
+        month = 12;
+        year -= 1;
+    } else if (month > 12) {
+        month = 1;
+        year += 1;
+    }
+    yearInput.value = year;
+    monthSelect.value = month;
+    showSelectedMonth();
+}
+
+document.getElementById('prevMonth').addEventListener('click', () => shiftMonth(-1));
+document.getElementById('nextMonth').addEventListener('click', () => shiftMonth(1));
+monthSelect.addEventListener('change', showSelectedMonth);
+yearInput.addEventListener('change', showSelectedMonth);
+
+showSelectedMonth();
@@ -0,0 +1,310 @@
+import calendar
+import json
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import date
+from common import (DirectorRule, DevelopmentDutyRule, MIN_STAFF_PER_DAY, MIN_STAFF_PER_SHIFT,
+                    REST_PER_WEEK, DUTY_MIN_GAP, DEV_DUTY_LIMIT, LEAVE_TYPES, OFF_SHIFTS,
+                    internal_pool, jiangdong_pool7, jiangdong_pool9)
+
+# Shifts only some people may hold: the duty pools the generator draws them from. A person may take
+# the shift on a weekday when their rule uses one of these pools and that pool has demand on the weekday
+SHIFT_POOLS = {
+    "江东班": (jiangdong_pool9, jiangdong_pool7),
+    "内勤": (internal_pool,),
+}
+
+# Nearest 值班 day in a neighbouring month, as a day number relative to this month (None = none)
+def _last_duty(entry, emp):
+    if entry is None or emp not in entry.employees:
+        return None
+    num_days = calendar.monthrange(entry.year, entry.month)[1]
+    for day in range(num_days, 0, -1):
+        if entry.schedule[(date(entry.year, entry.month, day), emp)] == "值班":
+            return day - num_days
+    return None
+
+def _first_duty(entry, emp, num_days):
+    if entry is None or emp not in entry.employees:
+        return None
+    for day in range(1, calendar.monthrange(entry.year, entry.month)[1] + 1):
+        if entry.schedule[(date(entry.year, entry.month, day), emp)] == "值班":
+            return num_days + day
+    return None
+
+logger = logging.getLogger(__name__)
+
+# Applied swaps, kept in a JSON file so they survive restarts and are put back whenever their month
+# is built again. Each swap records every cell it changed with the value before and after
+class SwapLog:
+    def __init__(self, path=None):
+        self.path = path
+        # "YYYY-MM" -> [{"cells": [[ISO date, employee, before, after], ...]}, ...]
+        self.months = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.months = json.load(f)
+
+    # Copy that is never written back, e.g. for months built outside the live store
+    def snapshot(self):
+        with self.lock:
+            log = SwapLog()
+            log.months = {key: list(swaps) for key, swaps in self.months.items()}
+            return log
+
+    def swaps(self, year, month):
+        with self.lock:
+            return list(self.months.get(f"{year}-{month:02d}", ()))
+
+    # changes: {(date, employee): new shift} applied to schedule
+    def add(self, year, month, schedule, changes):
+        cells = [[day.isoformat(), emp, schedule[(day, emp)], shift] for (day, emp), shift in sorted(changes.items())]
+        with self.lock:
+            self.months.setdefault(f"{year}-{month:02d}", []).append({"cells": cells})
+            self.save()
+
+    # Put the month's swaps back on a freshly built schedule. A swap is only re-applied when all its
+    # cells still hold their old values; otherwise (new leave, a different roster) it is dropped and returned
+    def reapply(self, year, month, schedule):
+        key = f"{year}-{month:02d}"
+        with self.lock:
+            kept = []
+            dropped = []
+            for swap in self.months.get(key, ()):
+                cells = [(date.fromisoformat(day), emp, before, after) for day, emp, before, after in swap["cells"]]
+                if all(schedule.get((day, emp)) == before for day, emp, before, _ in cells):
+                    for day, emp, _, after in cells:
+                        schedule[(day, emp)] = after
+                    kept.append(swap)
+                else:
+                    dropped.append(swap)
+            if dropped:
+                logger.warning("Dropped %d swap(s) in %s that no longer fit the rebuilt month", len(dropped), key)
+                if kept:
+                    self.months[key] = kept
+                else:
+                    self.months.pop(key, None)
+                self.save()
+            return dropped
+
+    def save(self):
+        if self.path:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.months, f, ensure_ascii=False, indent=1, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+
+# Raised when a swap breaks a scheduling constraint
+class SwapError(Exception):
+    def __init__(self, violations):
+        super().__init__("; ".join(violations))
+        self.violations = violations
+
+# Precomputed per-month lookups so a swap is checked without re-validating the month.
+# prev_entry / next_entry are the stored neighbouring months, if any, for the 值班 gap at the month edges
+class ConstraintIndex:
+    def __init__(self, entry, coworkers, prev_entry=None, next_entry=None):
+        self.entry = entry
+        self.prev_entry = prev_entry
+        self.next_entry = next_entry
+        self.coworkers = coworkers
+        self.year = entry.year
+        self.month = entry.month
+        self.num_days = calendar.monthrange(entry.year, entry.month)[1]
+        self.first_weekday = date(entry.year, entry.month, 1).weekday()
+        self.directors = {emp for emp, rule in coworkers.items() if isinstance(rule, DirectorRule)}
+        self.developers = {emp for emp, rule in coworkers.items() if isinstance(rule, DevelopmentDutyRule)}
+
+        # prev_duty[emp][day] / next_duty[emp][day]: nearest 值班 day strictly before / after day (None = none);
+        # days in the neighbouring months are numbered on from this month (0, -1, ... and num_days + 1, ...)
+        self.prev_duty = {}
+        self.next_duty = {}
+        # (emp, week) -> rest days; day -> people not resting; (day, shift) -> head count
+        self.rest_count = Counter()
+        self.coverage = Counter()
+        self.shift_count = Counter()
+        self.dev_count = Counter()
+        for emp in entry.employees:
+            shifts = [None] + [entry.schedule[(date(self.year, self.month, day), emp)] for day in range(1, self.num_days + 1)]
+            prev_row = [None] * (self.num_days + 2)
+            prev_row[0] = _last_duty(prev_entry, emp)
+            for day in range(1, self.num_days + 2):
+                prev_row[day] = day - 1 if day > 1 and shifts[day - 1] == "值班" else prev_row[day - 1]
+            next_row = [None] * (self.num_days + 2)
+            next_row[self.num_days + 1] = _first_duty(next_entry, emp, self.num_days)
+            for day in range(self.num_days, 0, -1):
+                next_row[day] = day + 1 if day < self.num_days and shifts[day + 1] == "值班" else next_row[day + 1]
+            self.prev_duty[emp] = prev_row
+            self.next_duty[emp] = next_row
+            for day in range(1, self.num_days + 1):
+                shift = shifts[day]
+                self.shift_count[(day, shift)] += 1
+                # Leave days count as days off, as in common.validate_week
+                if shift in OFF_SHIFTS:
+                    self.rest_count[(emp, self.week_of(day))] += 1
+                if shift not in OFF_SHIFTS:
+                    self.coverage[day] += 1
+                if shift == "开发班":
+                    self.dev_count[emp] += 1
+
+    def week_of(self, day):
+        return (day - 1 + self.first_weekday) // 7
+
+    def shift(self, emp, day):
+        return self.entry.schedule[(date(self.year, self.month, day), emp)]
+
+    # 值班 on a Saturday and the Sunday after it is one weekend duty (see DUTY_MIN_GAP)
+    def weekend_pair(self, earlier, later):
+        return later - earlier == 1 and (self.first_weekday + earlier - 1) % 7 == 5
+
+    def may_hold(self, emp, shift, day):
+        weekday = (self.first_weekday + day - 1) % 7
+        rule_pools = getattr(self.coworkers.get(emp), "duty_pools", ())
+        return any(pool in rule_pools and emp in pool.candidates and pool.demand.get(weekday)
+                   for pool in SHIFT_POOLS[shift])
+
+    # Check a list of (employee, day, new shift) cell changes; returns violation messages
+    def check(self, changes):
+        violations = []
+        rest_delta = Counter()
+        coverage_delta = Counter()
+        shift_delta = Counter()
+        dev_delta = Counter()
+        gained_duty = defaultdict(set)
+        lost_duty = defaultdict(set)
+        for emp, day, new in changes:
+            old = self.shift(emp, day)
+            if old == new:
+                continue
+            if old in LEAVE_TYPES:
+                violations.append(f"{emp} {self.month}月{day}日请假，不能换班")
+                continue
+            if new in LEAVE_TYPES:
+                # Already reported for the person on leave
+                continue
+            if new in SHIFT_POOLS and not self.may_hold(emp, new, day):
+                violations.append(f"{emp} 不能担任 {new}")
+            if new not in ("工作", "休息") and emp in self.directors:
+                violations.append(f"{emp} 不参与排班轮值")
+            if new == "开发班" and emp not in self.developers:
+                violations.append(f"{emp} 不能担任 开发班")
+            week = self.week_of(day)
+            rest_delta[(emp, week)] += (new in OFF_SHIFTS) - (old in OFF_SHIFTS)
+            coverage_delta[day] += (old in OFF_SHIFTS) - (new in OFF_SHIFTS)
+            shift_delta[(day, old)] -= 1
+            shift_delta[(day, new)] += 1
+            dev_delta[emp] += (new == "开发班") - (old == "开发班")
+            if new == "值班":
+                gained_duty[emp].add(day)
+            if old == "值班":
+                lost_duty[emp].add(day)
+
+        # Weekly rest may not drop below the required count
+        for (emp, week), delta in rest_delta.items():
+            after = self.rest_count[(emp, week)] + delta
+            if delta < 0 and after < REST_PER_WEEK:
+                violations.append(f"{emp} 第{week + 1}周休息少于{REST_PER_WEEK}天")
+
+        # Daily staffing may not drop below the minimums
+        for day, delta in coverage_delta.items():
+            weekday = (self.first_weekday + day - 1) % 7
+            if delta < 0 and self.coverage[day] + delta < MIN_STAFF_PER_DAY[weekday]:
+                violations.append(f"{self.month}月{day}日在岗人数不足")
+        for (day, shift), delta in shift_delta.items():
+            after = self.shift_count[(day, shift)] + delta
+            if delta < 0 and after < MIN_STAFF_PER_SHIFT.get(shift, 0):
+                violations.append(f"{self.month}月{day}日 {shift} 人数不足")
+            if shift == "开发班" and delta > 0 and after > 1:
+                violations.append(f"{self.month}月{day}日 开发班 超过一人")
+
+        for emp, delta in dev_delta.items():
+            if delta > 0 and self.dev_count[emp] + delta > DEV_DUTY_LIMIT:
+                violations.append(f"{emp} 本月开发班超过{DEV_DUTY_LIMIT}天")
+
+        # 值班 gap: walk past duties given away in the same swap and the other day of the same weekend
+        # duty, then compare with the other new duties. Walks stop at the neighbouring months' edge days
+        for emp, days in gained_duty.items():
+            lost = lost_duty[emp]
+            for day in days:
+                prev_day = self.prev_duty[emp][day]
+                while prev_day is not None and (prev_day in lost or self.weekend_pair(prev_day, day)):
+                    prev_day = self.prev_duty[emp][prev_day] if prev_day >= 1 else None
+                next_day = self.next_duty[emp][day]
+                while next_day is not None and (next_day in lost or self.weekend_pair(day, next_day)):
+                    next_day = self.next_duty[emp][next_day] if next_day <= self.num_days else None
+                neighbours = ([d for d in (prev_day, next_day) if d is not None]
+                              + [d for d in days if d != day and not self.weekend_pair(min(d, day), max(d, day))])
+                if any(abs(day - d) < DUTY_MIN_GAP for d in neighbours):
+                    violations.append(f"{emp} 两次值班间隔少于{DUTY_MIN_GAP}天")
+                    break
+        return violations
+
+# Exchange two people's shifts on one day, and optionally on a second day of the same month
+def swap_changes(index, employee_a, employee_b, day_a, day_b=None):
+    changes = []
+    for day in ([day_a] if day_b is None else [day_a, day_b]):
+        changes.append((employee_a, day, index.shift(employee_b, day)))
+        changes.append((employee_b, day, index.shift(employee_a, day)))
+    return changes
+
+# Proposes, validates and applies swaps against the stored schedules
+class SwapService:
+    def __init__(self, store):
+        self.store = store
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index_for(self, year, month):
+        entry = self.store.get(year, month)
+        prev_entry = self.store.entries.get((year - 1, 12) if month == 1 else (year, month - 1))
+        next_entry = self.store.entries.get((year + 1, 1) if month == 12 else (year, month + 1))
+        index = self.indexes.get((year, month))
+        if (index is None or index.entry is not entry or index.prev_entry is not prev_entry
+                or index.next_entry is not next_entry):
+            index = ConstraintIndex(entry, self.store.coworkers, prev_entry, next_entry)
+            self.indexes[(year, month)] = index
+        return index
+
+    def _resolve(self, employee_a, employee_b, date_a, date_b):
+        if date_b is not None and (date_b.year, date_b.month) != (date_a.year, date_a.month):
+            raise SwapError(["只能在同一个月内换班"])
+        for emp in (employee_a, employee_b):
+            if emp not in self.store.coworkers:
+                raise SwapError([f"未知员工 {emp}"])
+        if employee_a == employee_b:
+            raise SwapError(["不能与自己换班"])
+        index = self.index_for(date_a.year, date_a.month)
+        day_b = date_b.day if date_b is not None else None
+        return index, swap_changes(index, employee_a, employee_b, date_a.day, day_b)
+
+    def validate(self, employee_a, employee_b, date_a, date_b=None):
+        index, changes = self._resolve(employee_a, employee_b, date_a, date_b)
+        return index.check(changes)
+
+    def apply(self, employee_a, employee_b, date_a, date_b=None):
+        with self.lock:
+            index, changes = self._resolve(employee_a, employee_b, date_a, date_b)
+            violations = index.check(changes)
+            if violations:
+                raise SwapError(violations)
+            updates = {(date(index.year, index.month, day), emp): shift for emp, day, shift in changes}
+            entry = self.store.update(index.year, index.month, updates, expected=index.entry)
+            if entry is None:
+                raise SwapError(["排班表已被重新生成，请重试"])
+            return entry
+
+    # People who could take over employee's shift on that day in a same-day exchange
+    def partners(self, employee, on_date):
+        index = self.index_for(on_date.year, on_date.month)
+        if employee not in index.prev_duty:
+            raise SwapError([f"未知员工 {employee}"])
+        shift = index.shift(employee, on_date.day)
+        feasible = []
+        for other in index.entry.employees:
+            if other == employee or index.shift(other, on_date.day) == shift:
+                continue
+            if not index.check(swap_changes(index, employee, other, on_date.day)):
+                feasible.append({"employee": other, "shift": index.shift(other, on_date.day)})
+        return shift, feasible
@@ -0,0 +1,211 @@
+import calendar
+import os
+from datetime import date, timedelta
+from types import SimpleNamespace
+from common import (RestAllocator, LeaveCalendar, FairnessLedger, DutyPool, OFF_SHIFTS, build_schedule, coworkers,
+                    duty_pools, on_leave, validate_week)
+from rotation import RotationSet
+
+# 2025-03-03 is a Monday
+WEEK = [date(2025, 3, 3) + timedelta(days=i) for i in range(7)]
+
+def working_week(employees, dates=WEEK):
+    return {(d, emp): "工作" for d in dates for emp in employees}
+
+def coverage(schedule, d, employees):
+    return sum(1 for emp in employees if schedule[(d, emp)] not in OFF_SHIFTS)
+
+def test_rest_allocator_gives_every_employee_two_rest_days():
+    employees = [f"e{i}" for i in range(14)]
+    schedule = working_week(employees)
+    rest_days = {emp: set() for emp in employees}
+    RestAllocator().allocate(schedule, rest_days, WEEK, employees)
+    for emp in employees:
+        assert sum(1 for d in WEEK if schedule[(d, emp)] == "休息") == 2
+        assert rest_days[emp] == {d for d in WEEK if schedule[(d, emp)] == "休息"}
+    for d in WEEK:
+        assert coverage(schedule, d, employees) >= RestAllocator().min_staff_per_day[d.weekday()]
+
+def test_rest_allocator_never_goes_below_the_daily_minimum():
+    # 9 people, 8 needed on weekdays and 6 at weekends: not everyone can get two days off
+    employees = [f"e{i}" for i in range(9)]
+    schedule = working_week(employees)
+    RestAllocator().allocate(schedule, {emp: set() for emp in employees}, WEEK, employees)
+    for d in WEEK:
+        assert coverage(schedule, d, employees) >= RestAllocator().min_staff_per_day[d.weekday()]
+    # One day off fits on each weekday and three on each weekend day, and all of them are used
+    rests = [[schedule[(d, emp)] for d in WEEK].count("休息") for emp in employees]
+    assert sum(rests) == 5 * 1 + 2 * 3
+    assert min(rests) < 2
+
+def test_rest_allocator_keeps_existing_rest_and_other_shifts():
+    employees = [f"e{i}" for i in range(14)]
+    schedule = working_week(employees)
+    schedule[(WEEK[0], "e0")] = "休息"
+    schedule[(WEEK[1], "e0")] = "休息"
+    schedule[(WEEK[4], "e1")] = "值班"
+    allocator = RestAllocator(min_staff_per_day=(2,) * 7)
+    allocator.allocate(schedule, {emp: set() for emp in employees}, WEEK, employees)
+    # e0 already had two days off; only 工作 cells are ever turned into rest
+    assert [schedule[(d, "e0")] for d in WEEK].count("休息") == 2
+    assert schedule[(WEEK[4], "e1")] == "值班"
+
+def test_rest_allocator_keeps_the_minimum_per_shift():
+    employees = [f"e{i}" for i in range(4)]
+    schedule = working_week(employees)
+    RestAllocator(min_staff_per_day=(0,) * 7).allocate(schedule, {emp: set() for emp in employees}, WEEK, employees)
+    for d in WEEK:
+        assert sum(1 for emp in employees if schedule[(d, emp)] == "工作") >= 2
+
+def test_rest_allocator_is_repeatable():
+    employees = [f"e{i}" for i in range(14)]
+    first, second = working_week(employees), working_week(employees)
+    RestAllocator().allocate(first, {emp: set() for emp in employees}, WEEK, employees)
+    RestAllocator().allocate(second, {emp: set() for emp in employees}, WEEK, employees)
+    assert first == second
+
+def test_leave_bitmaps_split_a_range_at_month_edges():
+    leave = LeaveCalendar([("A", date(2024, 1, 30), date(2024, 3, 1), "病假")])
+    january, _ = leave.month_bitmaps(2024, 1)
+    february, kinds = leave.month_bitmaps(2024, 2)
+    march, _ = leave.month_bitmaps(2024, 3)
+    assert [day for day in range(1, 32) if on_leave(january, "A", day)] == [30, 31]
+    # The whole of a leap-year February, and nothing past day 29
+    assert february["A"] == (1 << 29) - 1
+    assert kinds[(date(2024, 2, 29), "A")] == "病假"
+    assert [day for day in range(1, 32) if on_leave(march, "A", day)] == [1]
+    assert leave.month_bitmaps(2024, 4) == ({}, {})
+
+def test_leave_bitmaps_merge_ranges_and_recompile_after_add():
+    leave = LeaveCalendar([("A", date(2025, 3, 31), date(2025, 3, 31), "年假")])
+    bits, _ = leave.month_bitmaps(2025, 3)
+    assert bits["A"] == 1 << 30
+    leave.add("A", date(2025, 3, 1), date(2025, 3, 2), "培训")
+    bits, kinds = leave.month_bitmaps(2025, 3)
+    assert bits["A"] == (1 << 30) | 0b11
+    assert kinds[(date(2025, 3, 2), "A")] == "培训"
+
+def test_leave_months_of_crosses_the_year():
+    assert list(LeaveCalendar.months_of(date(2024, 12, 20), date(2025, 2, 3))) == [(2024, 12), (2025, 1), (2025, 2)]
+
+def test_leave_is_reserved_in_the_built_month():
+    leave = LeaveCalendar([("楼峰", date(2025, 3, 28), date(2025, 4, 2), "年假")])
+    schedule = build_schedule(2025, 3, coworkers, leave=leave, ledger=FairnessLedger())
+    assert [schedule[(date(2025, 3, day), "楼峰")] for day in range(28, 32)] == ["年假"] * 4
+
+def test_leave_counts_as_days_off_in_validate_week():
+    schedule = working_week(["楼峰"])
+    for d in WEEK[:5]:
+        schedule[(d, "楼峰")] = "年假"
+    assert validate_week(schedule, "楼峰", WEEK, coworkers) == []
+    schedule[(WEEK[0], "楼峰")] = "工作"
+    schedule[(WEEK[1], "楼峰")] = "工作"
+    schedule[(WEEK[2], "楼峰")] = "工作"
+    schedule[(WEEK[3], "楼峰")] = "工作"
+    assert validate_week(schedule, "楼峰", WEEK, coworkers) == ["本周休息少于2天"]
+
+# Runs one pool over a month of working days, writing its picks into the schedule, and records the month
+def run_pool_month(ledger, pool, year, month, members, cells=None):
+    days = [date(year, month, day) for day in range(1, calendar.monthrange(year, month)[1] + 1)]
+    schedule = working_week(members, days)
+    schedule.update(cells or {})
+    ledger.begin_month(year, month)
+    pool.start_month(ledger, {emp: SimpleNamespace(duty_pools=(pool,)) for emp in members})
+    for d in days:
+        for emp in pool.assigned(d, schedule):
+            schedule[(d, emp)] = pool.ledger_key
+    ledger.end_month(schedule, [pool.ledger_key])
+    return schedule
+
+def month_counts(ledger, key, ledger_key):
+    return {emp: count for emp, (count, _) in ledger.months[key]["loads"][ledger_key].items()}
+
+def test_rebuilding_a_month_replaces_its_record():
+    ledger = FairnessLedger()
+    rotations = RotationSet.from_coworkers(coworkers)
+    first = build_schedule(2025, 3, coworkers, rotations=rotations, ledger=ledger)
+    record = ledger.months["2025-03"]
+    # Building the same month again starts from the same counts and records the same loads
+    assert build_schedule(2025, 3, coworkers, rotations=rotations, ledger=ledger) == first
+    assert ledger.months["2025-03"] == record
+    build_schedule(2025, 4, coworkers, rotations=rotations, ledger=ledger)
+    ledger.begin_month(2025, 5)
+    for pool in duty_pools(coworkers):
+        march, april = month_counts(ledger, "2025-03", pool.ledger_key), month_counts(ledger, "2025-04", pool.ledger_key)
+        for emp, count in march.items():
+            assert ledger.load(pool.ledger_key, emp)[0] == count + april.get(emp, 0)
+
+def test_record_month_follows_the_cells_after_a_swap():
+    ledger = FairnessLedger()
+    pool = DutyPool("K", ["A", "B"], {4: 1})
+    schedule = run_pool_month(ledger, pool, 2025, 3, ["A", "B"])
+    assert month_counts(ledger, "2025-03", "K") == {"A": 2, "B": 2}
+    # A hands the Friday 3/21 duty to B
+    schedule[(date(2025, 3, 21), "A")], schedule[(date(2025, 3, 21), "B")] = "工作", "K"
+    ledger.record_month(2025, 3, schedule, ["K"])
+    assert ledger.months["2025-03"]["loads"]["K"] == {"A": [1, "2025-03-07"], "B": [3, "2025-03-28"]}
+
+def test_fractional_demand_carries_over_to_the_next_month():
+    ledger = FairnessLedger()
+    pool = DutyPool("K", ["A", "B"], {4: 0.4})
+    # Four Fridays in March 2025: 0.4 + 0.4 + 0.4 + 0.4 gives one duty and leaves 0.6 over
+    march = run_pool_month(ledger, pool, 2025, 3, ["A", "B"])
+    assert sum(1 for shift in march.values() if shift == "K") == 1
+    assert round(ledger.months["2025-03"]["credits"]["K"][4], 6) == 0.6
+    # ... so the first Friday of April already reaches a whole duty, given to the one who had none
+    april = run_pool_month(ledger, pool, 2025, 4, ["A", "B"])
+    assert april[(date(2025, 4, 4), "B")] == "K"
+
+def test_ledger_directory_is_reloaded_and_only_changed_months_are_written(tmp_path):
+    directory = str(tmp_path / "fairness")
+    pool = DutyPool("K", ["A", "B"], {4: 1})
+    run_pool_month(FairnessLedger(directory), pool, 2025, 3, ["A", "B"])
+    path = os.path.join(directory, "2025-03.json")
+    os.utime(path, ns=(0, 0))
+    ledger = FairnessLedger(directory)
+    assert month_counts(ledger, "2025-03", "K") == {"A": 2, "B": 2}
+    run_pool_month(ledger, pool, 2025, 3, ["A", "B"])
+    assert os.stat(path).st_mtime_ns == 0
+    run_pool_month(ledger, pool, 2025, 3, ["A", "B"], cells={(date(2025, 3, 7), "A"): "年假"})
+    assert os.stat(path).st_mtime_ns != 0
+    assert sorted(os.listdir(directory)) == ["2025-03.json"]
+
+def test_snapshot_never_touches_the_original_ledger(tmp_path):
+    directory = str(tmp_path / "fairness")
+    pool = DutyPool("K", ["A", "B"], {4: 1})
+    ledger = FairnessLedger(directory)
+    run_pool_month(ledger, pool, 2025, 3, ["A", "B"])
+    scratch = ledger.snapshot()
+    run_pool_month(scratch, pool, 2025, 4, ["A", "B"])
+    run_pool_month(scratch, pool, 2025, 3, ["A", "B"], cells={(date(2025, 3, 7), "A"): "年假"})
+    assert list(ledger.months) == ["2025-03"]
+    assert month_counts(ledger, "2025-03", "K") == {"A": 2, "B": 2}
+    assert month_counts(FairnessLedger(directory), "2025-03", "K") == {"A": 2, "B": 2}
+
+def test_pools_sharing_a_ledger_key_see_each_others_picks():
+    ledger = FairnessLedger()
+    monday_pool = DutyPool("K-mon", ["A", "B"], {0: 1}, ledger_key="K")
+    other_pool = DutyPool("K-rest", ["A", "B"], {1: 1, 2: 1}, ledger_key="K")
+    members = {emp: SimpleNamespace(duty_pools=(monday_pool, other_pool)) for emp in ["A", "B"]}
+    schedule = working_week(["A", "B"])
+    ledger.begin_month(2025, 3)
+    monday_pool.start_month(ledger, members)
+    other_pool.start_month(ledger, members)
+    assert monday_pool.assigned(WEEK[0], schedule) == {"A"}
+    # The other pool's heap entry for A is stale; B has fewer duties
+    assert other_pool.assigned(WEEK[1], schedule) == {"B"}
+    # Both have one now, and A's was the longer ago
+    assert other_pool.assigned(WEEK[2], schedule) == {"A"}
+
+def test_pool_skips_people_not_working_or_within_the_gap():
+    ledger = FairnessLedger()
+    pool = DutyPool("K", ["A", "B"], {0: 1, 1: 1, 2: 1}, min_gap=4)
+    schedule = working_week(["A", "B"])
+    schedule[(WEEK[1], "B")] = "休息"
+    ledger.begin_month(2025, 3)
+    pool.start_month(ledger, {emp: SimpleNamespace(duty_pools=(pool,)) for emp in ["A", "B"]})
+    assert pool.assigned(WEEK[0], schedule) == {"A"}
+    # B rests and A had a duty the day before: nobody is left for Tuesday
+    assert pool.assigned(WEEK[1], schedule) == set()
+    # The people passed over go back into the pool
+    assert pool.assigned(WEEK[2], schedule) == {"B"}
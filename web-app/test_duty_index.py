@@ -0,0 +1,63 @@
+import calendar
+from datetime import date
+from duty_index import DutyIndex
+from schedule_store import ScheduleEntry
+
+STAFF = ["A", "B", "C"]
+
+# A month where everyone works except the given {employee: {day: shift}} cells
+def make_entry(year, month, cells, employees=STAFF):
+    num_days = calendar.monthrange(year, month)[1]
+    schedule = {(date(year, month, day), emp): "工作" for day in range(1, num_days + 1) for emp in employees}
+    for emp, days in cells.items():
+        for day, shift in days.items():
+            schedule[(date(year, month, day), emp)] = shift
+    return ScheduleEntry(year, month, schedule, list(employees))
+
+def test_next_duty_crosses_into_later_months():
+    index = DutyIndex()
+    # Indexed out of order; the combined lists are still sorted by date
+    index.refresh(2025, 4, make_entry(2025, 4, {"A": {2: "值班"}}))
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {6: "值班", 28: "值班"}}))
+    assert index.next_duty("A", "值班", date(2025, 3, 1)) == date(2025, 3, 6)
+    assert index.next_duty("A", "值班", date(2025, 3, 7)) == date(2025, 3, 28)
+    assert index.next_duty("A", "值班", date(2025, 3, 29)) == date(2025, 4, 2)
+    assert index.next_duty("A", "值班", date(2025, 4, 3)) is None
+
+def test_next_duty_includes_the_given_day_and_keeps_shifts_apart():
+    index = DutyIndex()
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {6: "值班", 10: "江东班"}, "B": {6: "江东班"}}))
+    assert index.next_duty("A", "值班", date(2025, 3, 6)) == date(2025, 3, 6)
+    assert index.next_duty("A", "江东班", date(2025, 3, 1)) == date(2025, 3, 10)
+    assert index.next_duty("B", "值班", date(2025, 3, 1)) is None
+    assert index.next_duty("C", "值班", date(2025, 3, 1)) is None
+
+def test_on_duty_lists_everyone_on_the_shift():
+    index = DutyIndex()
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {6: "江东班"}, "C": {6: "江东班"}, "B": {6: "值班"}}))
+    assert index.on_duty(date(2025, 3, 6), "江东班") == ("A", "C")
+    assert index.on_duty(date(2025, 3, 6), "值班") == ("B",)
+    assert index.on_duty(date(2025, 3, 7), "值班") == ()
+    # Only duty shifts are indexed
+    assert index.on_duty(date(2025, 3, 7), "工作") == ()
+
+def test_refresh_replaces_and_discards_months():
+    index = DutyIndex()
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {6: "值班"}}))
+    index.refresh(2025, 4, make_entry(2025, 4, {"A": {2: "值班"}}))
+    # A regenerated March drops the old duty instead of adding to it
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {20: "值班"}}))
+    assert index.next_duty("A", "值班", date(2025, 3, 1)) == date(2025, 3, 20)
+    assert index.on_duty(date(2025, 3, 6), "值班") == ()
+    index.refresh(2025, 3, None)
+    assert not index.has_month(2025, 3)
+    assert index.has_month(2025, 4)
+    assert index.next_duty("A", "值班", date(2025, 3, 1)) == date(2025, 4, 2)
+
+def test_readers_keep_the_snapshot_they_started_with():
+    index = DutyIndex()
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {6: "值班"}}))
+    snapshot = index.snapshot
+    index.refresh(2025, 3, make_entry(2025, 3, {"A": {20: "值班"}}))
+    assert snapshot.next_duty("A", "值班", date(2025, 3, 1)) == date(2025, 3, 6)
+    assert index.next_duty("A", "值班", date(2025, 3, 1)) == date(2025, 3, 20)
@@ -0,0 +1,64 @@
+import pytest
+from datetime import date, timedelta
+from rotation import Horizon, RotationRule, RotationSet, compile_rules, jiangdong_weekend_rotation
+
+def days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+def iso_parity(d):
+    return d.isocalendar()[1] % 2
+
+def test_iso_parity_matches_isocalendar_across_53_week_years():
+    # 2020 and 2026 both have an ISO week 53, so week 53 and the next week 1 are both odd
+    for start, end in [(date(2020, 12, 1), date(2021, 1, 31)), (date(2026, 12, 1), date(2027, 1, 31))]:
+        horizon = Horizon(start, end)
+        assert list(horizon.iso_parity()) == [iso_parity(d) for d in days(start, end)]
+        assert list(horizon.iso_parity(1)) == [iso_parity(d - timedelta(days=7)) for d in days(start, end)]
+        assert list(horizon.iso_parity(-1)) == [iso_parity(d + timedelta(days=7)) for d in days(start, end)]
+
+def test_jiangdong_weekend_and_rest_across_week_53():
+    start, end = date(2020, 12, 1), date(2021, 1, 31)
+    rules = [RotationRule.parse(text) for text in jiangdong_weekend_rotation(True)]
+    compiled = dict(compile_rules(rules, Horizon(start, end)).items())
+    for d in days(start, end):
+        if d.weekday() >= 5:
+            expected = "值班" if iso_parity(d) else None
+        elif d.weekday() in (3, 4):
+            # Thu/Fri off in the week before a duty weekend
+            expected = "休息" if iso_parity(d + timedelta(days=7)) else None
+        else:
+            expected = None
+        assert compiled.get(d) == expected, d
+    # Weeks 53 and 1 are back-to-back duty weekends, each with its own Thu/Fri off
+    assert compiled[date(2021, 1, 2)] == compiled[date(2021, 1, 9)] == "值班"
+    assert compiled[date(2020, 12, 24)] == compiled[date(2020, 12, 31)] == "休息"
+
+def test_period_phase_does_not_reset_at_new_year():
+    rule = RotationRule.parse("shift=值班 weekdays=日 period=3 phase=1")
+    sundays = sorted(dict(compile_rules([rule], Horizon(date(2025, 12, 1), date(2026, 2, 28))).items()))
+    assert all(d.weekday() == 6 for d in sundays)
+    assert all((b - a).days == 21 for a, b in zip(sundays, sundays[1:]))
+
+def test_higher_priority_wins_and_holidays_are_skipped():
+    # 2025-03-08 is a Saturday, treated as a holiday here
+    rules = [RotationRule.parse("shift=休息 weekdays=六,日"),
+             RotationRule.parse("shift=值班 weekdays=六 priority=5 holidays=skip")]
+    horizon = Horizon(date(2025, 3, 1), date(2025, 3, 9), holidays=[date(2025, 3, 8)])
+    compiled = dict(compile_rules(rules, horizon).items())
+    assert compiled[date(2025, 3, 1)] == "值班"
+    assert compiled[date(2025, 3, 2)] == "休息"
+    assert compiled[date(2025, 3, 8)] == "休息"
+    assert date(2025, 3, 3) not in compiled
+
+def test_employees_with_the_same_rules_share_one_compiled_result():
+    rotations = RotationSet({"A": ["shift=休息 weekdays=六,日"], "B": ["shift=休息 weekdays=六,日"],
+                             "C": ["shift=值班 weekdays=六"]})
+    compiled = rotations.compile(date(2025, 3, 1), date(2025, 3, 31))
+    assert compiled["A"] is compiled["B"]
+    assert compiled["A"] is not compiled["C"]
+
+@pytest.mark.parametrize("text", ["weekdays=六", "shift=值班 color=red", "shift=值班 period=2 phase=2",
+                                  "shift=值班 parity=sometimes", "shift=值班 holidays=never"])
+def test_invalid_rules_are_rejected(text):
+    with pytest.raises(ValueError):
+        RotationRule.parse(text)
@@ -0,0 +1,105 @@
+import calendar
+from datetime import date
+from common import coworkers
+from schedule_store import ScheduleEntry
+from swaps import ConstraintIndex, SwapLog, swap_changes
+
+# Enough people that no day falls below the staffing minimums unless a test means it to
+STAFF = ["A", "B"] + [f"x{i}" for i in range(10)]
+
+# A month where everyone works except the given {employee: {day: shift}} cells
+def make_entry(year, month, cells, employees=STAFF):
+    num_days = calendar.monthrange(year, month)[1]
+    schedule = {(date(year, month, day), emp): "工作" for day in range(1, num_days + 1) for emp in employees}
+    for emp, days in cells.items():
+        for day, shift in days.items():
+            schedule[(date(year, month, day), emp)] = shift
+    return ScheduleEntry(year, month, schedule, list(employees))
+
+def gap_violations(violations):
+    return [v for v in violations if "值班间隔" in v]
+
+def test_new_duty_too_close_to_existing_duty():
+    index = ConstraintIndex(make_entry(2025, 3, {"A": {6: "值班"}}), {})
+    assert gap_violations(index.check([("A", 8, "值班")]))
+    assert not gap_violations(index.check([("A", 10, "值班")]))
+
+def test_duty_given_away_in_the_same_swap_is_skipped():
+    # A hands day 6 to B and takes B's duty on day 8; the nearest remaining duty is day 2
+    index = ConstraintIndex(make_entry(2025, 3, {"A": {2: "值班", 6: "值班"}, "B": {8: "值班"}}), {})
+    assert index.check(swap_changes(index, "A", "B", 6, 8)) == []
+
+def test_walk_back_still_finds_an_earlier_duty():
+    # Giving away day 7 does not hide the duty on day 3 from a new duty on day 5
+    index = ConstraintIndex(make_entry(2025, 3, {"A": {3: "值班", 7: "值班"}, "B": {5: "值班"}}), {})
+    assert gap_violations(index.check(swap_changes(index, "A", "B", 7, 5)))
+
+def test_duty_gap_across_month_boundaries():
+    february = make_entry(2025, 2, {"A": {28: "值班"}})
+    april = make_entry(2025, 4, {"A": {1: "值班"}})
+    march = make_entry(2025, 3, {})
+    assert not gap_violations(ConstraintIndex(march, {}).check([("A", 2, "值班")]))
+    assert gap_violations(ConstraintIndex(march, {}, prev_entry=february).check([("A", 2, "值班")]))
+    assert gap_violations(ConstraintIndex(march, {}, next_entry=april).check([("A", 30, "值班")]))
+    assert not gap_violations(ConstraintIndex(march, {}, next_entry=april).check([("A", 27, "值班")]))
+
+def test_weekly_rest_may_not_drop_below_minimum():
+    # 2025-03-03 is a Monday; A rests twice that week, B three times
+    entry = make_entry(2025, 3, {"A": {4: "休息", 5: "休息"}, "B": {4: "休息", 5: "休息", 6: "休息"}})
+    index = ConstraintIndex(entry, {})
+    assert index.check([("A", 4, "工作")]) == ["A 第2周休息少于2天"]
+    assert index.check([("B", 4, "工作")]) == []
+    # Extra rest only raises the count
+    assert index.check([("A", 3, "休息")]) == []
+
+def test_daily_coverage_and_shift_minimums():
+    # Monday 2025-03-03: 12 people, 8 required; the four resting people have rest to spare that week
+    entry = make_entry(2025, 3, {emp: {3: "休息", 4: "休息", 5: "休息"} for emp in STAFF[:4]})
+    index = ConstraintIndex(entry, {})
+    assert index.coverage[3] == 8
+    assert index.check([("x5", 3, "休息")]) == ["3月3日在岗人数不足"]
+    # Exchanging rest and work keeps the head count
+    assert index.check(swap_changes(index, "A", "x5", 3)) == []
+
+def test_jiangdong_follows_the_weekday_split():
+    entry = make_entry(2025, 3, {}, employees=list(coworkers))
+    index = ConstraintIndex(entry, coworkers)
+    monday, wednesday = 3, 5
+    assert index.may_hold("楼峰", "江东班", monday)
+    assert index.may_hold("楼峰", "江东班", wednesday)
+    # 章杰 has the development rule and 郭向彬 is kept off the Mon/Tue pool
+    assert not index.may_hold("章杰", "江东班", monday)
+    assert not index.may_hold("郭向彬", "江东班", monday)
+    assert "章杰 不能担任 江东班" in index.check([("章杰", monday, "江东班")])
+    # 内勤 is only handed out on weekdays
+    assert index.may_hold("傅舒娜", "内勤", monday)
+    assert not index.may_hold("傅舒娜", "内勤", 8)
+
+def test_saturday_and_sunday_are_one_weekend_duty():
+    # 2025-03-08 is a Saturday
+    index = ConstraintIndex(make_entry(2025, 3, {"A": {8: "值班"}}), {})
+    assert not gap_violations(index.check([("A", 9, "值班")]))
+    assert gap_violations(index.check([("A", 7, "值班")]))
+    # The weekend is skipped, not the duty before it
+    index = ConstraintIndex(make_entry(2025, 3, {"A": {6: "值班", 8: "值班"}}), {})
+    assert gap_violations(index.check([("A", 9, "值班")]))
+
+def test_swap_log_survives_a_restart_and_is_reapplied(tmp_path):
+    path = str(tmp_path / "swaps.json")
+    entry = make_entry(2025, 3, {"A": {7: "值班"}})
+    SwapLog(path).add(2025, 3, entry.schedule, {(date(2025, 3, 7), "A"): "工作", (date(2025, 3, 7), "B"): "值班"})
+    rebuilt = dict(entry.schedule)
+    assert SwapLog(path).reapply(2025, 3, rebuilt) == []
+    assert rebuilt[(date(2025, 3, 7), "A")] == "工作"
+    assert rebuilt[(date(2025, 3, 7), "B")] == "值班"
+
+def test_swap_that_no_longer_fits_is_dropped(tmp_path):
+    path = str(tmp_path / "swaps.json")
+    entry = make_entry(2025, 3, {"A": {7: "值班"}})
+    SwapLog(path).add(2025, 3, entry.schedule, {(date(2025, 3, 7), "A"): "工作", (date(2025, 3, 7), "B"): "值班"})
+    # B has since been given leave on that day
+    rebuilt = make_entry(2025, 3, {"A": {7: "值班"}, "B": {7: "年假"}}).schedule
+    log = SwapLog(path)
+    assert len(log.reapply(2025, 3, rebuilt)) == 1
+    assert rebuilt[(date(2025, 3, 7), "B")] == "年假"
+    assert SwapLog(path).swaps(2025, 3) == []
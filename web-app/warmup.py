@@ -0,0 +1,49 @@
+import logging
+import threading
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Seconds between warmup rounds
+WARMUP_INTERVAL = 3600
+
+# The months people are about to download: the current one and the next
+# (which in December is January of the next year)
+def upcoming_months(today=None):
+    today = today or date.today()
+    if today.month == 12:
+        next_month = (today.year + 1, 1)
+    else:
+        next_month = (today.year, today.month + 1)
+    return [(today.year, today.month), next_month]
+
+# Background thread that builds and serializes upcoming months before they are requested
+class ScheduleWarmer:
+    def __init__(self, store, interval=WARMUP_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def warm(self, today=None):
+        for year, month in upcoming_months(today):
+            try:
+                # get() joins any request already building the month instead of duplicating it
+                self.store.get(year, month).xlsx_bytes()
+            except Exception:
+                logger.exception("Warming schedule %s-%02d failed", year, month)
+
+    def run(self):
+        # Warm immediately at startup, then on every interval
+        while True:
+            self.warm()
+            if self.stop_event.wait(self.interval):
+                break
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="schedule-warmer", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()